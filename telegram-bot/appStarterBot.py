@@ -1,102 +1,74 @@
-import os
 import time
 import threading
 import telebot
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from supabase import create_client, Client
-from datetime import datetime, timezone, timedelta  # ← добавлено
-import json  # ← добавлено
-
-# --- Конфигурация ---
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("Ошибка: BOT_TOKEN не установлен в переменных окружениях")
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Ошибка: SUPABASE_URL и SUPABASE_KEY должны быть установлены в переменных окружениях")
-
-WEBAPP_URL = os.getenv("WEBAPP_URL", "https://frontend-nine-sigma-49.vercel.app/")
-FREE_SPIN_CHECK_SEC = int(os.getenv("FREE_SPIN_CHECK_SEC", "900"))  # ← интервал проверки фриспина (по умолчанию 15 минут)
+from broadcast import BroadcastEngine
+from webhook_server import serve_webhook
+from appStarterCommon import (
+    BOT_TOKEN, SUPABASE_URL, SUPABASE_KEY,
+    FREE_SPIN_CHECK_SEC, FREE_SPIN_SYNC_SEC, DB_PAGE_SIZE,
+    FREE_MARKS_BATCH, FREE_MARKS_FLUSH_SEC,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_WORKERS,
+    NOTIFIERS_ENABLED, BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_QUEUE,
+    _participants_query, _pending_wheels_query, _wheels_notified_query, _cheapest_case_query,
+    _sells_query, _users_by_tids_query, _spun_users_query, _marks_update_query,
+    _utcnow, _welcome_message, _wheel_jobs, _free_jobs, _eligible_free, _only_depositors,
+    _depositors, _load_depositors_index, _apply_new_sells,
+    _free_sched, _schedule_free, _schedule_new_depositors, _retry_free_later, _pop_due_free, _free_wait_sec,
+    _free_mark_bucket, _journal_free_marks, _read_free_marks_journal,
+)
+
+# Конфиг, чистые хелперы и построители запросов — в appStarterCommon.py (общие с appStarterBotAsync.py).
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-bot = telebot.TeleBot(BOT_TOKEN)
+# в webhook-режиме хендлеры выполняются в нашем пуле, собственный пул telebot не нужен
+bot = telebot.TeleBot(BOT_TOKEN, threaded=(BOT_MODE != "webhook"))
+broadcaster = BroadcastEngine(bot, workers=BROADCAST_WORKERS, rate=BROADCAST_RATE, queue_size=BROADCAST_QUEUE)
 
 # --- Команда /start ---
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
-    user = message.from_user
-    args = message.text.split()
-    ref_id = args[1] if len(args) > 1 else None
-
-    print(f"🟢 /start от {user.id} ({user.username}) | ref_id: {ref_id}")
-
-    url = WEBAPP_URL
-    if ref_id and str(user.id) != str(ref_id):
-        url += f"?referrer={ref_id}&tgWebAppExpand=true"
-    else:
-        url += "?tgWebAppExpand=true"
-
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(
-        InlineKeyboardButton(
-            "🚀 Открыть приложение",
-            web_app=WebAppInfo(url=url)
-        )
-    )
-
-    bot.send_message(
-        message.chat.id,
-        f"Привет, {user.first_name or 'друг'}! 👋\nЗапусти Mini App по кнопке ниже:",
-        reply_markup=keyboard
-    )
+    text, keyboard = _welcome_message(message)
+    bot.send_message(message.chat.id, text, reply_markup=keyboard)
 
 # --- Фоновый поток: оповещения (как было) ---
+def _load_participants(wheel_ids):
+    rows, offset = [], 0
+    if not wheel_ids:
+        return rows
+    while True:
+        page = _participants_query(supabase, wheel_ids, offset).execute().data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
 def notify_users_loop():
     while True:
         try:
             # Получаем колёса, которые скоро начнутся, но ещё не были уведомлены
-            response = supabase.table('wheels').select('*') \
-                .eq('status', 'completed').eq('notified', False).execute()
+            response = _pending_wheels_query(supabase).execute()
 
             wheels = response.data if response.data else []
+            wheel_ids = [w['id'] for w in wheels]
+
+            # Всех участников всех колёс — одним запросом (in_), группируем в памяти
+            by_wheel = {}
+            for p in _load_participants(wheel_ids):
+                by_wheel.setdefault(p['wheel_id'], []).append(p)
+
+            jobs = _wheel_jobs(wheels, by_wheel)
 
-            for wheel in wheels:
-                wheel_id = wheel['id']
-                nft_name = wheel.get('nft_name', 'prize')
-
-                # Получаем всех участников этого колеса
-                participants_response = supabase.table('wheel_participants') \
-                    .select('telegram_id, username') \
-                    .eq('wheel_id', wheel_id).execute()
-
-                participants = participants_response.data if participants_response.data else []
-
-                for user in participants:
-                    telegram_id = user['telegram_id']
-                    username = user.get('username', 'Player')
-
-                    try:
-                        keyboard = InlineKeyboardMarkup()
-                        keyboard.add(
-                            InlineKeyboardButton(
-                                "🎯 Перейти к розыгрышу",
-                                web_app=WebAppInfo(url=f"{WEBAPP_URL}/wheel/{wheel_id}?tgWebAppExpand=true")
-                            )
-                        )
-
-                        bot.send_message(
-                            telegram_id,
-                            f"{username}! Your game for a prize {nft_name} will start in 1 minute! 🎁",
-                            reply_markup=keyboard
-                        )
-                        print(f"🔔 Уведомление отправлено пользователю {telegram_id}")
-                    except Exception as e:
-                        print(f"⚠️ Ошибка при отправке {telegram_id}: {e}")
-
-                # Помечаем, что уведомления отправлены
-                supabase.table('wheels').update({'notified': True}).eq('id', wheel_id).execute()
+            # Отправляем всю волну через общий движок
+            wave = broadcaster.broadcast(jobs)
+            for job in wave.failed:
+                print(f"⚠️ Ошибка при отправке {job['chat_id']}: {job.get('error')}")
+            if jobs:
+                print(f"🔔 Уведомления: {len(wave.sent)}/{len(jobs)} за {wave.elapsed:.1f}s ({wave.rate:.1f} msg/s)")
+
+            # Помечаем, что уведомления отправлены — одним UPDATE на все колёса
+            if wheel_ids:
+                _wheels_notified_query(supabase, wheel_ids).execute()
 
         except Exception as e:
             print("❌ Ошибка в потоке уведомлений:", e)
@@ -105,112 +77,190 @@ def notify_users_loop():
 
 # === ↓↓↓ НОВЫЙ БЛОК: бесплатный спин (фоновый поток) ↓↓↓ ===
 
-def _utcnow():
-    return datetime.now(timezone.utc)
-
-def _parse_ts(v):
-    if not v:
-        return None
-    try:
-        return datetime.fromisoformat(str(v).replace("Z", "+00:00")).astimezone(timezone.utc)
-    except Exception:
-        return None
-
 def _get_cheapest_case_id():
-    # самый дешёвый активный кейс (под бесплатный спин)
-    res = supabase.table("cases") \
-        .select("id, price, is_active") \
-        .eq("is_active", True) \
-        .order("price", ascending=True) \
-        .limit(1) \
-        .execute()
-    rows = res.data or []
+    rows = _cheapest_case_query(supabase).execute().data or []
     return rows[0]["id"] if rows else None
 
+def _fetch_new_sells(since):
+    rows, offset = [], 0
+    while True:
+        page = _sells_query(supabase, since, offset).execute().data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
 def _get_depositors_tids():
-    # все пользователи, у кого есть пополнения (sells)
-    res = supabase.table("sells").select("telegram_id").execute()
-    ids = [r["telegram_id"] for r in (res.data or []) if r.get("telegram_id")]
-    return list({int(x) for x in ids})
+    # все пользователи, у кого есть пополнения (sells) — из локального индекса + новые строки
+    _apply_new_sells(_fetch_new_sells(_depositors["watermark"]))
+    return list(_depositors["tids"])
 
 def _load_users_by_tids(tids):
     users = []
     for i in range(0, len(tids), 100):
-        batch = tids[i:i+100]
-        q = supabase.table("users").select(
-            "id, telegram_id, username, free_spin_last_at, free_spin_last_notified_at"
-        ).in_("telegram_id", batch).execute()
-        users.extend(q.data or [])
+        users.extend(_users_by_tids_query(supabase, tids[i:i+100]).execute().data or [])
     return users
 
-def _eligible_free(users):
-    # кандидаты на уведомление: есть депозит + (никогда не крутил или прошло 24ч) + ещё не уведомляли после наступления права
-    out, now = [], _utcnow()
-    day = timedelta(hours=24)
-    for u in users:
-        last = _parse_ts(u.get("free_spin_last_at"))
-        notified = _parse_ts(u.get("free_spin_last_notified_at"))
-        has_right = (last is None) or (now >= (last + day))
-        # уведомляем 1 раз на цикл, пока снова не будет free_spin_last_at + 24ч
-        edge = (last or datetime(1970, 1, 1, tzinfo=timezone.utc)) + day
-        not_notified_yet = (notified is None) or (notified < edge)
-        if has_right and not_notified_yet:
-            out.append(u)
-    return out
-
-def _build_free_markup(case_id: str):
-    # кнопка, открывающая mini-app на нужном кейсе
-    url = f"{WEBAPP_URL}?tgWebAppExpand=true&open_case={case_id}"
-    kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("🎁 Крутить бесплатно", web_app=WebAppInfo(url=url)))
-    return kb
+# --- Пакетная запись free_spin_last_notified_at ---
+# Вместо UPDATE на каждого получателя копим id в буфере, сгруппированном по «корзине» времени,
+# и сбрасываем одним UPDATE ... WHERE id IN (...) на корзину (журнал и корзины — в appStarterCommon).
+_free_marks = {"buf": {}, "count": 0, "first_at": None, "lock": threading.Lock(), "flush_lock": threading.Lock()}
+
+def _buffer_free_mark(user_id, at):
+    m = _free_marks
+    with m["lock"]:
+        _journal_free_marks([(at, user_id)])
+        m["buf"].setdefault(at, []).append(user_id)
+        m["count"] += 1
+        if m["first_at"] is None:
+            m["first_at"] = time.monotonic()
+        full = m["count"] >= FREE_MARKS_BATCH
+    if full:
+        _flush_free_marks(block=False)
 
 def _mark_free_notified(user_id: str):
-    supabase.table("users").update({
-        "free_spin_last_notified_at": _utcnow().isoformat()
-    }).eq("id", user_id).execute()
-
-def notify_free_spin_loop():
-    print("[free-spin] notifier started (interval:", FREE_SPIN_CHECK_SEC, "sec)")
+    _buffer_free_mark(user_id, _free_mark_bucket(_utcnow()))
+
+def _flush_free_marks(force=True, block=True):
+    # Буфер забираем под lock'ом, а UPDATE'ы делаем уже без него: воркеры рассылки,
+    # которые в это время ставят отметки, не ждут сети. Сбросы сериализованы отдельным
+    # flush_lock; воркер, заполнивший буфер (block=False), не ждёт чужой сброс.
+    m = _free_marks
+    if not m["flush_lock"].acquire(blocking=block):
+        return
+    try:
+        with m["lock"]:
+            if not m["count"]:
+                return
+            if not force and time.monotonic() - m["first_at"] < FREE_MARKS_FLUSH_SEC:
+                return
+            buf, count = m["buf"], m["count"]
+            m["buf"], m["count"], m["first_at"] = {}, 0, None
+
+        left = {}
+        for at, ids in buf.items():
+            for i in range(0, len(ids), 100):
+                chunk = ids[i:i+100]
+                try:
+                    _marks_update_query(supabase, at, chunk).execute()
+                except Exception as e:
+                    print("[free-spin] marks flush fail:", len(chunk), e)
+                    left.setdefault(at, []).extend(chunk)
+        flushed = count - sum(len(v) for v in left.values())
+
+        with m["lock"]:
+            for at, ids in left.items():
+                m["buf"].setdefault(at, []).extend(ids)
+                m["count"] += len(ids)
+            if m["count"] and m["first_at"] is None:
+                m["first_at"] = time.monotonic()
+            # в журнале остаются только несброшенные отметки (переписываем под lock'ом,
+            # чтобы не потерять строку, которую воркер дописывает прямо сейчас)
+            _journal_free_marks([(at, uid) for at, ids in m["buf"].items() for uid in ids], rewrite=True)
+    finally:
+        m["flush_lock"].release()
+    if flushed:
+        print(f"[free-spin] marks flushed: {flushed}")
+
+def _replay_free_marks():
+    entries = _read_free_marks_journal()
+    m = _free_marks
+    with m["lock"]:
+        for at, user_id in entries:
+            m["buf"].setdefault(at, []).append(user_id)
+        m["count"] += len(entries)
+        if entries and m["first_at"] is None:
+            m["first_at"] = time.monotonic()
+    if entries:
+        print(f"[free-spin] replaying {len(entries)} marks from journal")
+        _flush_free_marks()
+
+# --- Планировщик по дедлайнам (состояние и хелперы — в appStarterCommon) ---
+def _load_spun_users_since(since):
+    rows, offset = [], 0
     while True:
-        try:
-            # 1) выясняем самый дешёвый активный кейс
-            case_id = _get_cheapest_case_id()
-            if not case_id:
-                time.sleep(FREE_SPIN_CHECK_SEC)
-                continue
+        page = _spun_users_query(supabase, since, offset).execute().data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return _only_depositors(rows)
+        offset += DB_PAGE_SIZE
 
-            # 2) у кого были пополнения
-            tids = _get_depositors_tids()
-            if not tids:
-                time.sleep(FREE_SPIN_CHECK_SEC)
-                continue
+def _sync_free_schedule():
+    _schedule_new_depositors(_apply_new_sells(_fetch_new_sells(_depositors["watermark"])))
+    _schedule_free(_load_spun_users_since(_free_sched["spin_watermark"]))
 
-            # 3) подгружаем пользователей и фильтруем по условию фриспина
-            users = _load_users_by_tids(tids)
-            cand = _eligible_free(users)
+def _notify_free_due(due):
+    try:
+        # перечитываем только «созревших» — их состояние могло измениться с момента планирования
+        users = _load_users_by_tids(due)
+        cand = _eligible_free(users)
+        case_id = _get_cheapest_case_id() if cand else None
+    except Exception as e:
+        print("[free-spin] due load fail:", e)
+        _retry_free_later(due)
+        return
+
+    # остальным пересчитываем дедлайн (например, успели покрутить)
+    cand_ids = {u["id"] for u in cand}
+    _schedule_free([u for u in users if u["id"] not in cand_ids])
+
+    if cand and not case_id:
+        # нет активного кейса — попробуем этих же пользователей позже
+        _retry_free_later([int(u["telegram_id"]) for u in cand])
+        return
+
+    if cand:
+        print(f"[free-spin] candidates: {len(cand)}")
+
+    # 3) отправляем уведомления через общий движок; отметка ставится сразу после успешной отправки
+    jobs = _free_jobs(cand, case_id)
+    wave = broadcaster.broadcast(jobs, on_sent=lambda job: _mark_free_notified(job["user_id"]))
+    for job in wave.failed:
+        print("[free-spin] send fail:", job["chat_id"], job.get("error"))
+        _retry_free_later([int(job["chat_id"])])
+    if jobs:
+        print(f"[free-spin] sent {len(wave.sent)}/{len(jobs)} in {wave.elapsed:.1f}s ({wave.rate:.1f} msg/s)")
+
+    _flush_free_marks()
 
-            if cand:
-                print(f"[free-spin] candidates: {len(cand)}")
+def notify_free_spin_loop():
+    print("[free-spin] notifier started (sync:", FREE_SPIN_SYNC_SEC, "sec)")
+    _load_depositors_index()
+    _replay_free_marks()
 
-            # 4) отправляем уведомления
-            for u in cand:
-                try:
-                    kb = _build_free_markup(case_id)
-                    bot.send_message(
-                        u["telegram_id"],
-                        "🎁 Доступен бесплатный спин! Испытай удачу прямо сейчас.",
-                        reply_markup=kb
-                    )
-                    _mark_free_notified(u["id"])
-                    print("[free-spin] sent →", u["telegram_id"])
-                except Exception as e:
-                    print("[free-spin] send fail:", u["telegram_id"], e)
+    # начальная загрузка: один раз читаем всех депозиторов и строим heap
+    while True:
+        try:
+            tids = _get_depositors_tids()
+            _schedule_free(_load_users_by_tids(tids))
+            if not _free_sched["spin_watermark"]:
+                _free_sched["spin_watermark"] = _utcnow().isoformat()
+            print(f"[free-spin] scheduled: {len(_free_sched['deadline'])} of {len(tids)} depositors")
+            break
+        except Exception as e:
+            print("[free-spin] init fail:", e)
+            time.sleep(FREE_SPIN_CHECK_SEC)
 
+    next_sync = time.monotonic() + FREE_SPIN_SYNC_SEC
+    while True:
+        try:
+            # 1) подтягиваем изменения, если подошло время синка
+            if time.monotonic() >= next_sync:
+                next_sync = time.monotonic() + FREE_SPIN_SYNC_SEC
+                _sync_free_schedule()
+
+            # сброс отметок, если они висят в буфере дольше FREE_MARKS_FLUSH_SEC
+            _flush_free_marks(force=False)
+
+            # 2) кого пора уведомлять
+            due = _pop_due_free(_utcnow())
+            if due:
+                _notify_free_due(due)
         except Exception as e:
             print("[free-spin] tick fail:", e)
 
-        time.sleep(FREE_SPIN_CHECK_SEC)
+        # 4) спим ровно до ближайшего дедлайна (или до следующего синка / сброса отметок)
+        time.sleep(_free_wait_sec(next_sync, _free_marks["first_at"], time.monotonic()))
 
 # === ↑↑↑ КОНЕЦ НОВОГО БЛОКА ↑↑↑ ===
 
@@ -218,11 +268,31 @@ def notify_free_spin_loop():
 if __name__ == "__main__":
     print("🚀 AppStarterBot запущен и ждёт /start")
 
-    # Поток уведомлений по колёсам (твой существующий)
-    threading.Thread(target=notify_users_loop, daemon=True).start()
+    if NOTIFIERS_ENABLED:
+        # Общий движок рассылки для обоих потоков уведомлений
+        broadcaster.start()
+
+        # Поток уведомлений по колёсам (твой существующий)
+        threading.Thread(target=notify_users_loop, daemon=True).start()
 
-    # Поток уведомлений о бесплатном спине (новый)
-    threading.Thread(target=notify_free_spin_loop, daemon=True).start()
+        # Поток уведомлений о бесплатном спине (новый)
+        threading.Thread(target=notify_free_spin_loop, daemon=True).start()
 
     # Основной цикл бота
-    bot.infinity_polling()
+    if BOT_MODE == "webhook":
+        if WEBHOOK_URL:
+            bot.remove_webhook()
+            bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        serve_webhook(
+            lambda update: bot.process_new_updates([telebot.types.Update.de_json(update)]),
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret=WEBHOOK_SECRET,
+            workers=WEBHOOK_WORKERS,
+        )
+    else:
+        bot.infinity_polling()
+
+    # штатная остановка: досбрасываем отметки фриспина (остальное подхватит журнал)
+    _flush_free_marks()
@@ -0,0 +1,313 @@
+import time
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from telebot.async_telebot import AsyncTeleBot
+from supabase import acreate_client, AsyncClient
+
+from broadcast import AsyncBroadcastEngine
+from appStarterCommon import (
+    BOT_TOKEN, SUPABASE_URL, SUPABASE_KEY,
+    FREE_SPIN_CHECK_SEC, FREE_SPIN_SYNC_SEC, DB_PAGE_SIZE,
+    FREE_MARKS_BATCH, FREE_MARKS_FLUSH_SEC,
+    BROADCAST_WORKERS, BROADCAST_RATE, BROADCAST_QUEUE,
+    _participants_query, _pending_wheels_query, _wheels_notified_query, _cheapest_case_query,
+    _sells_query, _users_by_tids_query, _spun_users_query, _marks_update_query,
+    _utcnow, _welcome_message, _wheel_jobs, _free_jobs, _eligible_free, _only_depositors,
+    _depositors, _load_depositors_index, _apply_new_sells,
+    _free_sched, _schedule_free, _schedule_new_depositors, _retry_free_later, _pop_due_free, _free_wait_sec,
+    _free_mark_bucket, _journal_free_marks, _read_free_marks_journal,
+)
+
+# Asyncio-рантайм AppStarterBot: /start, оповещения по колёсам и фриспин-оповещения — таски
+# одного event loop поверх AsyncTeleBot и асинхронного клиента Supabase. Конфиг, чистые хелперы
+# и построители запросов общие с appStarterBot.py (appStarterCommon.py), здесь только ввод-вывод.
+# Запуск: python appStarterBotAsync.py
+
+bot = AsyncTeleBot(BOT_TOKEN)
+broadcaster = AsyncBroadcastEngine(bot, workers=BROADCAST_WORKERS, rate=BROADCAST_RATE, queue_size=BROADCAST_QUEUE)
+supabase: AsyncClient = None  # создаётся в main() внутри loop
+# запись журнала отметок (fsync) — вне event loop, в одном потоке: порядок дозаписей и
+# перезаписи журнала сохраняется
+_journal_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="marks-journal")
+
+
+# --- Команда /start ---
+@bot.message_handler(commands=['start'])
+async def send_welcome(message):
+    text, keyboard = _welcome_message(message)
+    await bot.send_message(message.chat.id, text, reply_markup=keyboard)
+
+
+# --- Оповещения по колёсам ---
+async def _load_participants(wheel_ids):
+    rows, offset = [], 0
+    if not wheel_ids:
+        return rows
+    while True:
+        page = (await _participants_query(supabase, wheel_ids, offset).execute()).data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
+
+async def notify_users_task():
+    while True:
+        try:
+            response = await _pending_wheels_query(supabase).execute()
+
+            wheels = response.data if response.data else []
+            wheel_ids = [w['id'] for w in wheels]
+
+            by_wheel = {}
+            for p in await _load_participants(wheel_ids):
+                by_wheel.setdefault(p['wheel_id'], []).append(p)
+
+            jobs = _wheel_jobs(wheels, by_wheel)
+            wave = await broadcaster.broadcast(jobs)
+            for job in wave.failed:
+                print(f"⚠️ Ошибка при отправке {job['chat_id']}: {job.get('error')}")
+            if jobs:
+                print(f"🔔 Уведомления: {len(wave.sent)}/{len(jobs)} за {wave.elapsed:.1f}s ({wave.rate:.1f} msg/s)")
+
+            if wheel_ids:
+                await _wheels_notified_query(supabase, wheel_ids).execute()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("❌ Ошибка в задаче уведомлений:", e)
+
+        await asyncio.sleep(10)
+
+
+# --- Фриспин: чтение из БД ---
+async def _get_cheapest_case_id():
+    rows = (await _cheapest_case_query(supabase).execute()).data or []
+    return rows[0]["id"] if rows else None
+
+
+async def _fetch_new_sells():
+    rows, offset = [], 0
+    while True:
+        page = (await _sells_query(supabase, _depositors["watermark"], offset).execute()).data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return rows
+        offset += DB_PAGE_SIZE
+
+
+async def _get_depositors_tids():
+    _apply_new_sells(await _fetch_new_sells())
+    return list(_depositors["tids"])
+
+
+async def _load_users_by_tids(tids):
+    users = []
+    for i in range(0, len(tids), 100):
+        users.extend((await _users_by_tids_query(supabase, tids[i:i+100]).execute()).data or [])
+    return users
+
+
+async def _load_spun_users_since(since):
+    rows, offset = [], 0
+    while True:
+        page = (await _spun_users_query(supabase, since, offset).execute()).data or []
+        rows.extend(page)
+        if len(page) < DB_PAGE_SIZE:
+            return _only_depositors(rows)
+        offset += DB_PAGE_SIZE
+
+
+async def _sync_free_schedule():
+    _schedule_new_depositors(_apply_new_sells(await _fetch_new_sells()))
+    _schedule_free(await _load_spun_users_since(_free_sched["spin_watermark"]))
+
+
+# --- Фриспин: пакетные отметки (тот же журнал, что и в sync-рантайме) ---
+_amarks = {"buf": {}, "count": 0, "first_at": None, "flush_lock": asyncio.Lock()}
+
+
+def _journal(entries, rewrite=False):
+    # ставим в очередь журнала сразу (синхронно), ждать можно потом — порядок задаёт очередь
+    return asyncio.get_running_loop().run_in_executor(_journal_io, _journal_free_marks, entries, rewrite)
+
+
+async def _mark_free_notified(user_id):
+    at = _free_mark_bucket(_utcnow())
+    journaled = _journal([(at, user_id)])
+    m = _amarks
+    m["buf"].setdefault(at, []).append(user_id)
+    m["count"] += 1
+    if m["first_at"] is None:
+        m["first_at"] = time.monotonic()
+    await journaled
+    if m["count"] >= FREE_MARKS_BATCH:
+        await _flush_free_marks()
+
+
+async def _flush_free_marks(force=True):
+    # сбросы по одному: иначе перезапись журнала одним сбросом выкинет отметки, которые
+    # ещё в полёте у другого
+    async with _amarks["flush_lock"]:
+        await _flush_free_marks_locked(force)
+
+
+async def _flush_free_marks_locked(force):
+    m = _amarks
+    if not m["count"]:
+        return
+    if not force and time.monotonic() - m["first_at"] < FREE_MARKS_FLUSH_SEC:
+        return
+    # забираем буфер целиком: новые отметки во время await попадут в свежий буфер
+    buf, count = m["buf"], m["count"]
+    m["buf"], m["count"], m["first_at"] = {}, 0, None
+    left = {}
+    for at, ids in buf.items():
+        for i in range(0, len(ids), 100):
+            chunk = ids[i:i+100]
+            try:
+                await _marks_update_query(supabase, at, chunk).execute()
+            except asyncio.CancelledError:
+                left.setdefault(at, []).extend(chunk)
+                raise
+            except Exception as e:
+                print("[free-spin] marks flush fail:", len(chunk), e)
+                left.setdefault(at, []).extend(chunk)
+    for at, ids in left.items():
+        m["buf"].setdefault(at, []).extend(ids)
+        m["count"] += len(ids)
+    if m["count"] and m["first_at"] is None:
+        m["first_at"] = time.monotonic()
+    await _journal([(at, uid) for at, ids in m["buf"].items() for uid in ids], rewrite=True)
+    flushed = count - sum(len(v) for v in left.values())
+    if flushed:
+        print(f"[free-spin] marks flushed: {flushed}")
+
+
+async def _replay_free_marks():
+    entries = _read_free_marks_journal()
+    for at, user_id in entries:
+        _amarks["buf"].setdefault(at, []).append(user_id)
+    _amarks["count"] += len(entries)
+    if entries:
+        _amarks["first_at"] = time.monotonic()
+        print(f"[free-spin] replaying {len(entries)} marks from journal")
+        await _flush_free_marks()
+
+
+# --- Фриспин: планировщик по дедлайнам ---
+async def _notify_free_due(due):
+    try:
+        users = await _load_users_by_tids(due)
+        cand = _eligible_free(users)
+        case_id = await _get_cheapest_case_id() if cand else None
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print("[free-spin] due load fail:", e)
+        _retry_free_later(due)
+        return
+
+    cand_ids = {u["id"] for u in cand}
+    _schedule_free([u for u in users if u["id"] not in cand_ids])
+
+    if cand and not case_id:
+        _retry_free_later([int(u["telegram_id"]) for u in cand])
+        return
+
+    if cand:
+        print(f"[free-spin] candidates: {len(cand)}")
+
+    jobs = _free_jobs(cand, case_id)
+    wave = await broadcaster.broadcast(jobs, on_sent=lambda job: _mark_free_notified(job["user_id"]))
+    for job in wave.failed:
+        print("[free-spin] send fail:", job["chat_id"], job.get("error"))
+        _retry_free_later([int(job["chat_id"])])
+    if jobs:
+        print(f"[free-spin] sent {len(wave.sent)}/{len(jobs)} in {wave.elapsed:.1f}s ({wave.rate:.1f} msg/s)")
+
+    await _flush_free_marks()
+
+
+async def notify_free_spin_task():
+    print("[free-spin] notifier started (sync:", FREE_SPIN_SYNC_SEC, "sec)")
+    _load_depositors_index()
+    await _replay_free_marks()
+
+    while True:
+        try:
+            tids = await _get_depositors_tids()
+            _schedule_free(await _load_users_by_tids(tids))
+            if not _free_sched["spin_watermark"]:
+                _free_sched["spin_watermark"] = _utcnow().isoformat()
+            print(f"[free-spin] scheduled: {len(_free_sched['deadline'])} of {len(tids)} depositors")
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("[free-spin] init fail:", e)
+            await asyncio.sleep(FREE_SPIN_CHECK_SEC)
+
+    next_sync = time.monotonic() + FREE_SPIN_SYNC_SEC
+    while True:
+        try:
+            if time.monotonic() >= next_sync:
+                next_sync = time.monotonic() + FREE_SPIN_SYNC_SEC
+                await _sync_free_schedule()
+
+            await _flush_free_marks(force=False)
+
+            due = _pop_due_free(_utcnow())
+            if due:
+                await _notify_free_due(due)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("[free-spin] tick fail:", e)
+
+        await asyncio.sleep(_free_wait_sec(next_sync, _amarks["first_at"], time.monotonic()))
+
+
+# --- Запуск ---
+async def main():
+    global supabase
+    supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    print("🚀 AppStarterBot (asyncio) запущен и ждёт /start")
+
+    broadcaster.start()
+    tasks = [
+        asyncio.create_task(notify_users_task(), name="wheels"),
+        asyncio.create_task(notify_free_spin_task(), name="free-spin"),
+        asyncio.create_task(bot.infinity_polling(), name="polling"),
+    ]
+
+    # кооперативная остановка: на сигнал отменяем все таски
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остаётся KeyboardInterrupt
+
+    try:
+        await stop.wait()
+    finally:
+        print("🛑 Остановка...")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await broadcaster.stop()
+        try:
+            await asyncio.wait_for(_flush_free_marks(), timeout=10)
+        except Exception as e:
+            print("[free-spin] final flush fail (останется в журнале):", e)
+        _journal_io.shutdown(wait=True)
+        await bot.close_session()
+        print("✅ Остановлено")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,351 @@
+import os
+import json
+import heapq
+from datetime import datetime, timezone, timedelta
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+
+# Общее для appStarterBot.py (потоки) и appStarterBotAsync.py (asyncio): конфиг, чистые хелперы,
+# построители запросов к Supabase и состояние планировщика фриспина. Импорт этого модуля
+# ничего не создаёт — ни клиентов, ни бота, ни хендлеров. Запросы строятся здесь один раз,
+# а .execute() (обычный или await) вызывает уже конкретный рантайм.
+
+# --- Конфигурация ---
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+if not BOT_TOKEN:
+    raise ValueError("Ошибка: BOT_TOKEN не установлен в переменных окружениях")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+if not SUPABASE_URL or not SUPABASE_KEY:
+    raise ValueError("Ошибка: SUPABASE_URL и SUPABASE_KEY должны быть установлены в переменных окружениях")
+
+WEBAPP_URL = os.getenv("WEBAPP_URL", "https://frontend-nine-sigma-49.vercel.app/")
+FREE_SPIN_CHECK_SEC = int(os.getenv("FREE_SPIN_CHECK_SEC", "900"))  # ← интервал проверки фриспина (по умолчанию 15 минут)
+# локальный индекс депозиторов (множество telegram_id + watermark по sells.created_at)
+DEPOSITORS_INDEX_FILE = os.getenv(
+    "DEPOSITORS_INDEX_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "depositors_index.json")
+)
+FREE_SPIN_SYNC_SEC = int(os.getenv("FREE_SPIN_SYNC_SEC", "60"))  # как часто подтягиваем новых депозиторов и свежие спины
+# буфер отметок free_spin_last_notified_at: сбрасываем пачкой по размеру или по времени
+FREE_MARKS_BATCH = int(os.getenv("FREE_MARKS_BATCH", "200"))
+FREE_MARKS_FLUSH_SEC = float(os.getenv("FREE_MARKS_FLUSH_SEC", "5"))
+FREE_MARKS_BUCKET_SEC = int(os.getenv("FREE_MARKS_BUCKET_SEC", "60"))  # округление времени отметки (вверх)
+FREE_MARKS_JOURNAL_FILE = os.getenv(
+    "FREE_MARKS_JOURNAL_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "free_spin_marks.jsonl")
+)
+# режим получения апдейтов: polling (как раньше) или webhook (локальный HTTP-сервер + пул воркеров)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес; без него set_webhook не вызываем (локальный тест)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+if BOT_MODE == "webhook" and WEBHOOK_URL and not WEBHOOK_SECRET:
+    # публичный endpoint без секрета принимает поддельные апдейты от кого угодно
+    raise ValueError("Ошибка: при WEBHOOK_URL нужно задать WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+# при нескольких инстансах за балансировщиком фоновые рассылки должны крутиться только в одном
+NOTIFIERS_ENABLED = os.getenv("NOTIFIERS_ENABLED", "1") == "1"
+# общий движок рассылки (лимиты Bot API: ~30 msg/s на бота, ~1 msg/s в один чат)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_QUEUE = int(os.getenv("BROADCAST_QUEUE", "1000"))
+DB_PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", "1000"))  # PostgREST по умолчанию отдаёт не больше 1000 строк
+
+USER_FIELDS = "id, telegram_id, username, free_spin_last_at, free_spin_last_notified_at"
+
+# --- Команда /start ---
+def _welcome_message(message):
+    # текст и кнопка приветствия (общие для sync- и asyncio-рантайма)
+    user = message.from_user
+    args = message.text.split()
+    ref_id = args[1] if len(args) > 1 else None
+
+    print(f"🟢 /start от {user.id} ({user.username}) | ref_id: {ref_id}")
+
+    url = WEBAPP_URL
+    if ref_id and str(user.id) != str(ref_id):
+        url += f"?referrer={ref_id}&tgWebAppExpand=true"
+    else:
+        url += "?tgWebAppExpand=true"
+
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(
+        InlineKeyboardButton(
+            "🚀 Открыть приложение",
+            web_app=WebAppInfo(url=url)
+        )
+    )
+
+    return f"Привет, {user.first_name or 'друг'}! 👋\nЗапусти Mini App по кнопке ниже:", keyboard
+
+# --- Запросы к Supabase (без .execute()) ---
+def _participants_query(client, wheel_ids, offset):
+    # участники сразу нескольких колёс, постранично (PostgREST режет ответ по max-rows)
+    return client.table('wheel_participants') \
+        .select('wheel_id, telegram_id, username') \
+        .in_('wheel_id', wheel_ids) \
+        .order('wheel_id').order('telegram_id') \
+        .range(offset, offset + DB_PAGE_SIZE - 1)
+
+def _pending_wheels_query(client):
+    # колёса, которые скоро начнутся, но ещё не были уведомлены
+    return client.table('wheels').select('id, nft_name') \
+        .eq('status', 'completed').eq('notified', False)
+
+def _wheels_notified_query(client, wheel_ids):
+    return client.table('wheels').update({'notified': True}).in_('id', wheel_ids)
+
+def _cheapest_case_query(client):
+    # самый дешёвый активный кейс (под бесплатный спин)
+    return client.table("cases") \
+        .select("id, price, is_active") \
+        .eq("is_active", True) \
+        .order("price", desc=False) \
+        .limit(1)
+
+def _sells_query(client, since, offset):
+    # постранично читаем sells начиная с watermark
+    q = client.table("sells").select("telegram_id, created_at")
+    if since:
+        q = q.gte("created_at", since)
+    return q.order("created_at", desc=False).range(offset, offset + DB_PAGE_SIZE - 1)
+
+def _users_by_tids_query(client, batch):
+    return client.table("users").select(USER_FIELDS).in_("telegram_id", batch)
+
+def _spun_users_query(client, since, offset):
+    # пользователи, у которых free_spin_last_at сдвинулся после watermark, постранично по возрастанию:
+    # watermark двигается к максимуму прочитанного, и без полного чтения хвост потерялся бы навсегда
+    q = client.table("users").select(USER_FIELDS)
+    if since:
+        q = q.gt("free_spin_last_at", since)
+    return q.order("free_spin_last_at", desc=False).order("id") \
+        .range(offset, offset + DB_PAGE_SIZE - 1)
+
+def _marks_update_query(client, at, ids):
+    return client.table("users").update({"free_spin_last_notified_at": at}).in_("id", ids)
+
+# --- Оповещения по колёсам ---
+def _wheel_jobs(wheels, by_wheel):
+    # сообщения участникам всех колёс одной волной
+    jobs = []
+    for wheel in wheels:
+        wheel_id = wheel['id']
+        nft_name = wheel.get('nft_name', 'prize')
+        participants = by_wheel.get(wheel_id, [])
+
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(
+            InlineKeyboardButton(
+                "🎯 Перейти к розыгрышу",
+                web_app=WebAppInfo(url=f"{WEBAPP_URL}/wheel/{wheel_id}?tgWebAppExpand=true")
+            )
+        )
+
+        for user in participants:
+            username = user.get('username', 'Player')
+            jobs.append({
+                "chat_id": user['telegram_id'],
+                "text": f"{username}! Your game for a prize {nft_name} will start in 1 minute! 🎁",
+                "reply_markup": keyboard,
+            })
+    return jobs
+
+# --- Бесплатный спин ---
+def _utcnow():
+    return datetime.now(timezone.utc)
+
+def _parse_ts(v):
+    if not v:
+        return None
+    try:
+        return datetime.fromisoformat(str(v).replace("Z", "+00:00")).astimezone(timezone.utc)
+    except Exception:
+        return None
+
+# --- Инкрементальный индекс депозиторов ---
+# Множество telegram_id заполняется один раз, дальше читаем только новые строки sells
+# (created_at >= watermark). Строки на границе watermark перечитываются, но это безопасно:
+# добавление в множество идемпотентно. Индекс сохраняется на диск, чтобы рестарт не
+# вызывал полного пересканирования.
+_depositors = {"watermark": None, "tids": set()}
+
+def _load_depositors_index():
+    if not os.path.exists(DEPOSITORS_INDEX_FILE):
+        return
+    try:
+        with open(DEPOSITORS_INDEX_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        _depositors["watermark"] = data.get("watermark")
+        _depositors["tids"] = {int(x) for x in data.get("tids", [])}
+        print(f"[free-spin] depositors index loaded: {len(_depositors['tids'])} tids, watermark={_depositors['watermark']}")
+    except Exception as e:
+        # битый файл — просто начинаем с нуля (один полный скан)
+        print("[free-spin] depositors index load fail, full rescan:", e)
+        _depositors["watermark"] = None
+        _depositors["tids"] = set()
+
+def _save_depositors_index():
+    tmp = DEPOSITORS_INDEX_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"watermark": _depositors["watermark"], "tids": sorted(_depositors["tids"])}, f)
+    os.replace(tmp, DEPOSITORS_INDEX_FILE)  # атомарная замена — не оставляем полузаписанный индекс
+
+def _apply_new_sells(rows):
+    # возвращает только новых telegram_id; индекс пишем на диск, только если что-то изменилось
+    # (строка на границе watermark перечитывается каждый раз и ничего не меняет)
+    new_tids, watermark = [], _depositors["watermark"]
+    for r in rows:
+        if r.get("telegram_id"):
+            tid = int(r["telegram_id"])
+            if tid not in _depositors["tids"]:
+                _depositors["tids"].add(tid)
+                new_tids.append(tid)
+        ts = _parse_ts(r.get("created_at"))
+        if ts and (not _depositors["watermark"] or ts > _parse_ts(_depositors["watermark"])):
+            _depositors["watermark"] = ts.isoformat()
+    if new_tids or _depositors["watermark"] != watermark:
+        _save_depositors_index()
+    if new_tids:
+        print(f"[free-spin] new depositors: +{len(new_tids)} (total {len(_depositors['tids'])})")
+    return new_tids
+
+def _only_depositors(users):
+    return [u for u in users if u.get("telegram_id") and int(u["telegram_id"]) in _depositors["tids"]]
+
+def _eligible_free(users):
+    # кандидаты на уведомление: есть депозит + (никогда не крутил или прошло 24ч) + ещё не уведомляли после наступления права
+    out, now = [], _utcnow()
+    day = timedelta(hours=24)
+    for u in users:
+        last = _parse_ts(u.get("free_spin_last_at"))
+        notified = _parse_ts(u.get("free_spin_last_notified_at"))
+        has_right = (last is None) or (now >= (last + day))
+        # уведомляем 1 раз на цикл, пока снова не будет free_spin_last_at + 24ч
+        edge = (last or datetime(1970, 1, 1, tzinfo=timezone.utc)) + day
+        not_notified_yet = (notified is None) or (notified < edge)
+        if has_right and not_notified_yet:
+            out.append(u)
+    return out
+
+def _build_free_markup(case_id: str):
+    # кнопка, открывающая mini-app на нужном кейсе
+    url = f"{WEBAPP_URL}?tgWebAppExpand=true&open_case={case_id}"
+    kb = InlineKeyboardMarkup()
+    kb.add(InlineKeyboardButton("🎁 Крутить бесплатно", web_app=WebAppInfo(url=url)))
+    return kb
+
+def _free_jobs(cand, case_id):
+    kb = _build_free_markup(case_id)
+    return [{
+        "chat_id": u["telegram_id"],
+        "text": "🎁 Доступен бесплатный спин! Испытай удачу прямо сейчас.",
+        "reply_markup": kb,
+        "user_id": u["id"],
+    } for u in cand]
+
+# --- Журнал отметок free_spin_last_notified_at ---
+# Время отметки округляется ВВЕРХ до границы корзины: отметка не может оказаться раньше
+# момента появления права (иначе повторное уведомление). Каждая отметка сначала дописывается
+# в локальный журнал, так что падение процесса их не теряет: при старте журнал переигрывается.
+def _free_mark_bucket(ts):
+    epoch = int(ts.timestamp())
+    ceil = -(-epoch // FREE_MARKS_BUCKET_SEC) * FREE_MARKS_BUCKET_SEC
+    return datetime.fromtimestamp(ceil, tz=timezone.utc).isoformat()
+
+def _journal_free_marks(entries, rewrite=False):
+    if rewrite:
+        tmp = FREE_MARKS_JOURNAL_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for at, user_id in entries:
+                f.write(json.dumps({"id": user_id, "at": at}) + "\n")
+        os.replace(tmp, FREE_MARKS_JOURNAL_FILE)
+        return
+    with open(FREE_MARKS_JOURNAL_FILE, "a", encoding="utf-8") as f:
+        for at, user_id in entries:
+            f.write(json.dumps({"id": user_id, "at": at}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _read_free_marks_journal():
+    entries = []
+    if not os.path.exists(FREE_MARKS_JOURNAL_FILE):
+        return entries
+    with open(FREE_MARKS_JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+                entries.append((r["at"], r["id"]))
+            except Exception:
+                continue  # недописанная последняя строка после падения
+    return entries
+
+# --- Планировщик по дедлайнам ---
+# Для каждого депозитора считаем момент появления права (free_spin_last_at + 24ч) и держим
+# эти моменты в heap. Рантайм спит ровно до ближайшего дедлайна, а между дедлайнами раз в
+# FREE_SPIN_SYNC_SEC инкрементально подтягивает изменения: новых депозиторов (из индекса) и
+# пользователей, у которых сдвинулся free_spin_last_at (т.е. они покрутили).
+# В heap лежат (deadline, telegram_id); устаревшие записи отсекаются сверкой с _free_sched["deadline"].
+_free_sched = {"heap": [], "deadline": {}, "spin_watermark": None}
+
+def _next_free_deadline(u):
+    # момент, когда пользователя нужно уведомить; None — уже уведомлён, ждём нового спина
+    last = _parse_ts(u.get("free_spin_last_at"))
+    notified = _parse_ts(u.get("free_spin_last_notified_at"))
+    edge = (last or datetime(1970, 1, 1, tzinfo=timezone.utc)) + timedelta(hours=24)
+    if notified is not None and notified >= edge:
+        return None
+    return edge
+
+def _schedule_free(users):
+    for u in users:
+        tid = int(u["telegram_id"])
+        last = _parse_ts(u.get("free_spin_last_at"))
+        wm = _parse_ts(_free_sched["spin_watermark"])
+        if last and (wm is None or last > wm):
+            _free_sched["spin_watermark"] = last.isoformat()
+        deadline = _next_free_deadline(u)
+        if deadline is None:
+            _free_sched["deadline"].pop(tid, None)
+            continue
+        if _free_sched["deadline"].get(tid) == deadline:
+            continue
+        _free_sched["deadline"][tid] = deadline
+        heapq.heappush(_free_sched["heap"], (deadline, tid))
+
+def _schedule_new_depositors(new_tids):
+    # новых депозиторов ставим «на сейчас»: _notify_free_due сам прочитает и оценит их
+    now = _utcnow()
+    for tid in new_tids:
+        _free_sched["deadline"][tid] = now
+        heapq.heappush(_free_sched["heap"], (now, tid))
+
+def _retry_free_later(tids):
+    # повторная попытка через FREE_SPIN_CHECK_SEC (нет кейса, ошибка отправки/чтения)
+    retry_at = _utcnow() + timedelta(seconds=FREE_SPIN_CHECK_SEC)
+    for tid in tids:
+        _free_sched["deadline"][tid] = retry_at
+        heapq.heappush(_free_sched["heap"], (retry_at, tid))
+
+def _pop_due_free(now):
+    due = []
+    heap = _free_sched["heap"]
+    while heap and heap[0][0] <= now:
+        deadline, tid = heapq.heappop(heap)
+        if _free_sched["deadline"].get(tid) != deadline:
+            continue  # запись устарела — дедлайн уже пересчитан
+        del _free_sched["deadline"][tid]
+        due.append(tid)
+    return due
+
+def _free_wait_sec(next_sync, marks_first_at, now_mono):
+    # сколько спать: до синка, до сброса отметок или до ближайшего дедлайна
+    wait = next_sync - now_mono
+    if marks_first_at is not None:
+        wait = min(wait, marks_first_at + FREE_MARKS_FLUSH_SEC - now_mono)
+    if _free_sched["heap"]:
+        wait = min(wait, (_free_sched["heap"][0][0] - _utcnow()).total_seconds())
+    return max(0.0, wait)
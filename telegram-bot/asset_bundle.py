@@ -0,0 +1,185 @@
+import os
+import sys
+import glob
+import json
+import mmap
+
+# Упакованный бандл ассетов: один pack-файл со всеми файлами из manifest.json + индекс
+#   bundle.index.json: {"pack": "bundle-<gen>.pack", "size": ..., "garbage": ...,
+#                       "entries": {slug: {ext: [offset, length, sha256]}}}
+# Пересборка инкрементальная: файлы, чей sha256 в манифесте совпал с индексом, не трогаются,
+# новые/изменённые дописываются в конец pack'а (старые байты становятся «мусором»).
+# Когда мусора больше BUNDLE_COMPACT_RATIO — pack переписывается в новое поколение; старый удаляется,
+# а если он ещё открыт читателем (mmap на Windows не даёт удалить) — при следующей сборке.
+# Индекс пишется атомарно и только после fsync pack'а, поэтому читатель со старым индексом
+# всегда видит целые данные. Чтение — через mmap (memoryview без копирования) или
+# locate() → (путь, offset, length) для Range/sendfile.
+#   python asset_bundle.py [ANIMATIONS_DIR]
+
+BUNDLE_INDEX = "bundle.index.json"
+BUNDLE_COMPACT_RATIO = float(os.getenv("BUNDLE_COMPACT_RATIO", "0.5"))
+
+MIME_TYPES = {
+    "tgs": "application/x-tgsticker",
+    "json": "application/json",
+    "json.gz": "application/json",  # + Content-Encoding: gzip
+    "json.br": "application/json",  # + Content-Encoding: br
+    "png": "image/png",
+    "webp": "image/webp",
+    "webm": "video/webm",
+}
+
+
+def _mime(ext):
+    # превью "64.webp" → по последнему расширению
+    return MIME_TYPES.get(ext) or MIME_TYPES.get(ext.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+def _load_index(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"gen": 0, "pack": None, "size": 0, "garbage": 0, "entries": {}}
+
+
+def _save_index(path, index):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _copy_into(pack, src_path):
+    offset = pack.tell()
+    with open(src_path, "rb") as src:
+        while True:
+            chunk = src.read(1 << 20)
+            if not chunk:
+                break
+            pack.write(chunk)
+    return offset, pack.tell() - offset
+
+
+def _compact(bundle_dir, index, wanted, animations_dir):
+    """Переписываем живые файлы в новое поколение pack'а; старый удаляем после смены индекса."""
+    gen = index["gen"] + 1
+    name = f"bundle-{gen}.pack"
+    entries = {}
+    with open(os.path.join(bundle_dir, name), "wb") as pack:
+        for slug, files in wanted.items():
+            for ext, info in files.items():
+                off, length = _copy_into(pack, os.path.join(animations_dir, f"{slug}.{ext}"))
+                entries.setdefault(slug, {})[ext] = [off, length, info["sha256"]]
+        pack.flush()
+        os.fsync(pack.fileno())
+        size = pack.tell()
+    return {"gen": gen, "pack": name, "size": size, "garbage": 0, "entries": entries}
+
+
+def _remove_stale_packs(bundle_dir, keep):
+    # старые поколения; занятые читателем (Windows) оставляем до следующей сборки
+    for path in glob.glob(os.path.join(bundle_dir, "bundle-*.pack")):
+        if os.path.basename(path) == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"⚠ Старый pack {os.path.basename(path)} пока не удалить: {e}")
+
+
+def build_bundle(animations_dir, manifest, bundle_dir=None):
+    """
+    Приводит бандл в соответствие с manifest (slug → files {ext: {size, sha256}}).
+    Возвращает (index, stats) — stats: added, kept, removed, compacted.
+    """
+    bundle_dir = bundle_dir or animations_dir
+    index_path = os.path.join(bundle_dir, BUNDLE_INDEX)
+    index = _load_index(index_path)
+    wanted = {slug: entry.get("files", {}) for slug, entry in manifest.items()}
+    stats = {"added": 0, "kept": 0, "removed": 0, "compacted": False}
+
+    old_entries = index["entries"]
+    for slug, files in old_entries.items():
+        for ext, (off, length, sha) in files.items():
+            if wanted.get(slug, {}).get(ext, {}).get("sha256") != sha:
+                index["garbage"] += length
+                stats["removed"] += 1
+
+    todo = [(slug, ext, info) for slug, files in wanted.items() for ext, info in files.items()
+            if old_entries.get(slug, {}).get(ext, [None, None, None])[2] != info["sha256"]]
+    stats["kept"] = sum(len(f) for f in wanted.values()) - len(todo)
+
+    if index["pack"] is None or index["garbage"] > BUNDLE_COMPACT_RATIO * max(index["size"], 1):
+        index = _compact(bundle_dir, index, wanted, animations_dir)
+        stats["added"] = len(todo)
+        stats["compacted"] = True
+        _save_index(index_path, index)
+        _remove_stale_packs(bundle_dir, index["pack"])
+        return index, stats
+
+    entries = {slug: {ext: v for ext, v in files.items()
+                      if wanted.get(slug, {}).get(ext, {}).get("sha256") == v[2]}
+               for slug, files in old_entries.items() if slug in wanted}
+    if todo:
+        with open(os.path.join(bundle_dir, index["pack"]), "r+b") as pack:
+            pack.seek(index["size"])  # хвост после незавершённой прошлой записи просто перезатрём
+            pack.truncate()
+            for slug, ext, info in todo:
+                off, length = _copy_into(pack, os.path.join(animations_dir, f"{slug}.{ext}"))
+                entries.setdefault(slug, {})[ext] = [off, length, info["sha256"]]
+            pack.flush()
+            os.fsync(pack.fileno())
+            index["size"] = pack.tell()
+        stats["added"] = len(todo)
+    index["entries"] = entries
+    _save_index(index_path, index)
+    _remove_stale_packs(bundle_dir, index["pack"])
+    return index, stats
+
+
+class BundleReader:
+    """Чтение из бандла: get() — memoryview над mmap без копирования, locate() — для Range-ответов."""
+
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        self.index = _load_index(os.path.join(bundle_dir, BUNDLE_INDEX))
+        if self.index["pack"] is None:
+            # бандл ещё не собирался — пустой читатель, locate()/get() вернут None
+            self.pack_path, self._file, self._map = None, None, b""
+            return
+        self.pack_path = os.path.join(bundle_dir, self.index["pack"])
+        self._file = open(self.pack_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.index["size"] else b""
+
+    def locate(self, slug, ext):
+        """(путь к pack, offset, length, mime) или None."""
+        entry = self.index["entries"].get(slug, {}).get(ext)
+        if not entry:
+            return None
+        return self.pack_path, entry[0], entry[1], _mime(ext)
+
+    def get(self, slug, ext, start=0, end=None):
+        """Байты файла (или его диапазона [start, end)) как memoryview — без копирования (отпустить до close())."""
+        entry = self.index["entries"].get(slug, {}).get(ext)
+        if not entry:
+            return None
+        off, length = entry[0], entry[1]
+        end = length if end is None else min(end, length)
+        return memoryview(self._map)[off + start:off + end]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._file:
+            self._file.close()
+
+
+if __name__ == "__main__":
+    animations_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv(
+        "ANIMATIONS_DIR", "C:/Users/PC/Desktop/frontend/fronted-server/public/animations")
+    with open(os.path.join(animations_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    index, stats = build_bundle(animations_dir, manifest)
+    print(f"📦 {index['pack']}: {index['size']} байт, мусор {index['garbage']} | "
+          f"+{stats['added']} ={stats['kept']} -{stats['removed']}"
+          f"{' (перепакован)' if stats['compacted'] else ''}")
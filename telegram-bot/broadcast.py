@@ -0,0 +1,258 @@
+import time
+import queue
+import asyncio
+import threading
+
+# Общий движок рассылки для бота: пул воркеров + глобальный token bucket под лимиты Bot API
+# (~30 сообщений/сек на бота) + не чаще одного сообщения в секунду в один чат.
+# На 429 воркер ставит на паузу ВСЕ отправки на retry_after и повторяет то же сообщение.
+# AsyncBroadcastEngine — то же самое для asyncio-рантайма (AsyncTeleBot, воркеры-таски).
+
+
+def _retry_after(e):
+    # telebot.apihelper.ApiTelegramException: error_code=429, result_json.parameters.retry_after
+    if getattr(e, "error_code", None) != 429:
+        return None
+    params = (getattr(e, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Wave:
+    # одна «волна» рассылки: ждём, пока все её сообщения будут отправлены или упадут
+    def __init__(self, total):
+        self.left = total
+        self.sent = []
+        self.failed = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.cv = threading.Condition()
+
+    def done(self, job, ok):
+        with self.cv:
+            (self.sent if ok else self.failed).append(job)
+            self.left -= 1
+            if self.left <= 0:
+                self.elapsed = time.monotonic() - self.started
+                self.cv.notify_all()
+
+    def wait(self):
+        with self.cv:
+            while self.left > 0:
+                self.cv.wait()
+        return self
+
+    @property
+    def rate(self):
+        return len(self.sent) / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class BroadcastEngine:
+    def __init__(self, bot, workers=8, rate=25, per_chat_sec=1.0, queue_size=1000, max_retries=3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_sec = per_chat_sec
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=queue_size)  # ограниченная очередь: submit блокируется при переполнении
+        self.workers = workers
+        self._chat_last = {}
+        self._chat_lock = threading.Lock()
+        self._paused_until = 0.0
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"broadcast-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def broadcast(self, jobs, on_sent=None):
+        """
+        Отправляет список jobs ({"chat_id", "text", "reply_markup", ...}) и ждёт окончания.
+        on_sent(job) вызывается из воркера сразу после успешной отправки.
+        Возвращает волну: .sent, .failed, .elapsed, .rate (сообщений/сек).
+        """
+        wave = _Wave(len(jobs))
+        if not jobs:
+            return wave
+        for job in jobs:
+            self.queue.put((job, wave, on_sent))
+        return wave.wait()
+
+    def _wait_chat_slot(self, chat_id):
+        # не чаще одного сообщения в per_chat_sec в один чат
+        while True:
+            with self._chat_lock:
+                now = time.monotonic()
+                wait = self._chat_last.get(chat_id, 0.0) + self.per_chat_sec - now
+                if wait <= 0:
+                    self._chat_last[chat_id] = now
+                    return
+            time.sleep(wait)
+
+    def _send(self, job):
+        attempt = 0
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self._wait_chat_slot(job["chat_id"])
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(job["chat_id"], job["text"], reply_markup=job.get("reply_markup"))
+                return True
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    job["error"] = e
+                    return False
+                attempt += 1
+                # 429 — глобальная пауза для всех воркеров
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                print(f"[broadcast] 429 flood limit, pause {retry_after}s (attempt {attempt})")
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            job, wave, on_sent = item
+            ok = self._send(job)
+            if ok and on_sent:
+                try:
+                    on_sent(job)
+                except Exception as e:
+                    print("[broadcast] on_sent fail:", job.get("chat_id"), e)
+            wave.done(job, ok)
+
+
+class AsyncTokenBucket:
+    # в одном event loop проверка и списание атомарны (между ними нет await)
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncBroadcastEngine:
+    def __init__(self, bot, workers=8, rate=25, per_chat_sec=1.0, queue_size=1000, max_retries=3):
+        self.bot = bot
+        self.bucket = AsyncTokenBucket(rate)
+        self.per_chat_sec = per_chat_sec
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.workers = workers
+        self.queue = None
+        self._chat_last = {}
+        self._paused_until = 0.0
+        self._tasks = []
+
+    def start(self):
+        # очередь создаём внутри работающего loop
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"broadcast-{i}") for i in range(self.workers)]
+        return self
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def broadcast(self, jobs, on_sent=None):
+        """
+        Асинхронный аналог BroadcastEngine.broadcast. on_sent может быть корутинной функцией.
+        """
+        wave = _Wave(len(jobs))
+        if not jobs:
+            return wave
+        finished = asyncio.get_running_loop().create_future()
+        for job in jobs:
+            await self.queue.put((job, wave, on_sent, finished))
+        await finished
+        return wave
+
+    async def _wait_chat_slot(self, chat_id):
+        while True:
+            now = time.monotonic()
+            wait = self._chat_last.get(chat_id, 0.0) + self.per_chat_sec - now
+            if wait <= 0:
+                self._chat_last[chat_id] = now
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, job):
+        attempt = 0
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._wait_chat_slot(job["chat_id"])
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(job["chat_id"], job["text"], reply_markup=job.get("reply_markup"))
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt >= self.max_retries:
+                    job["error"] = e
+                    return False
+                attempt += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                print(f"[broadcast] 429 flood limit, pause {retry_after}s (attempt {attempt})")
+
+    async def _worker(self):
+        while True:
+            job, wave, on_sent, finished = await self.queue.get()
+            ok = await self._send(job)
+            if ok and on_sent:
+                try:
+                    res = on_sent(job)
+                    if asyncio.iscoroutine(res):
+                        await res
+                except Exception as e:
+                    print("[broadcast] on_sent fail:", job.get("chat_id"), e)
+            wave.done(job, ok)
+            if wave.left <= 0 and not finished.done():
+                finished.set_result(None)
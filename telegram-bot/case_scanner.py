@@ -1,11 +1,15 @@
 # case_scanner.py
 import os
+import sys
+import json
 import asyncio
 from datetime import datetime
 from uuid import uuid4
 
-from pyrogram import Client
+from pyrogram import Client, filters, idle, utils
 from pyrogram.enums import MessageServiceType
+from pyrogram.handlers import MessageHandler
+from pyrogram.raw.functions.messages import GetHistory
 from supabase import create_client, Client as SupabaseClient
 
 # --- Telegram auth () ---
@@ -22,7 +26,85 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.e
 supabase: SupabaseClient = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 TABLE = "gifts_for_cases"
-SCAN_LIMIT = 1  # сколько сообщений пролистывать
+PAGE_SIZE = 100  # сообщений за один запрос истории (максимум MTProto)
+
+# Чекпоинт: самый большой обработанный msg_id по каждому чату. Читаем только сообщения новее него,
+# страницами от старых к новым, и сохраняем чекпоинт после каждой страницы — упавший скан
+# продолжится с последней сохранённой страницы (повтор страницы безопасен благодаря антидублю).
+CHECKPOINT_FILE = os.getenv(
+    "SCAN_CHECKPOINT_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "case_scanner_checkpoint.json")
+)
+# Без чекпоинта скан начинается с уже записанного (max(msg_id) в TABLE) или, если таблица пуста,
+# с текущего верха чата: перечитка всей истории с нуля — тысячи лишних запросов, и строки без msg_id
+# (записанные старым сканером) антидубль по msg_id не узнает. Полный проход с начала — только явно:
+# --backfill или SCAN_START_MSG_ID=0.
+SCAN_START_MSG_ID = os.getenv("SCAN_START_MSG_ID")  # откуда начинать, если чекпоинта ещё нет
+
+
+def load_checkpoint(peer):
+    """Сохранённый чекпоинт или None, если его ещё нет."""
+    try:
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            value = json.load(f).get(str(peer))
+    except FileNotFoundError:
+        return None
+    return int(value) if value is not None else None
+
+
+async def initial_checkpoint(app: Client, peer) -> int:
+    """Чекпоинт для первого запуска (см. SCAN_START_MSG_ID); сразу сохраняется."""
+    if "--backfill" in sys.argv[1:]:
+        checkpoint, source = 0, "--backfill"
+    elif SCAN_START_MSG_ID is not None:
+        checkpoint, source = int(SCAN_START_MSG_ID), "SCAN_START_MSG_ID"
+    else:
+        res = await asyncio.to_thread(
+            lambda: supabase.table(TABLE).select("msg_id")
+            .not_.is_("msg_id", "null").order("msg_id", desc=True).limit(1).execute()
+        )
+        if res.data:
+            checkpoint, source = int(res.data[0]["msg_id"]), f"max(msg_id) в {TABLE}"
+        else:
+            top = [m async for m in app.get_chat_history(peer, limit=1)]
+            checkpoint, source = (top[0].id if top else 0), "верх чата"
+    save_checkpoint(peer, checkpoint)
+    print(f"📍 Чекпоинта не было — начинаем с msg_id={checkpoint} ({source})")
+    return checkpoint
+
+
+def save_checkpoint(peer, msg_id: int):
+    data = {}
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    data[str(peer)] = msg_id
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, CHECKPOINT_FILE)  # атомарно: чекпоинт либо старый, либо новый
+
+
+async def read_page_after(app: Client, peer, after_id: int):
+    """
+    Одна страница сообщений с id > after_id, по возрастанию id — ровно один запрос messages.GetHistory.
+    offset_id + отрицательный add_offset — стандартный приём MTProto для чтения «вперёд», min_id
+    отсекает всё не новее чекпоинта. get_chat_history тут не годится: он повторяет запрос с тем же
+    add_offset, пока не наберёт limit, и при k < PAGE_SIZE новых сообщениях делает ~PAGE_SIZE/k
+    запросов с дублями.
+    """
+    r = await app.invoke(GetHistory(
+        peer=await app.resolve_peer(peer),
+        offset_id=after_id + 1,
+        offset_date=0,
+        add_offset=-PAGE_SIZE,
+        limit=PAGE_SIZE,
+        max_id=0,
+        min_id=after_id,
+        hash=0,
+    ))
+    msgs = await utils.parse_messages(app, r, replies=0)
+    return sorted((m for m in msgs if m.id > after_id), key=lambda m: m.id)
 
 
 async def ensure_peer(app: Client, peer):
@@ -41,6 +123,119 @@ async def ensure_peer(app: Client, peer):
         pass
 
 
+def gift_row(msg):
+    """Строка для TABLE из сервисного сообщения с подарком (или None, если это не подарок)."""
+    # интересуют только сервисные сообщения с подарками
+    if msg.service != MessageServiceType.GIFT:
+        return None
+    gift = getattr(msg, "gift", None)
+    if not gift:
+        return None
+
+    slug = gift.name or ""           # ключ для кейсов
+    return {
+        "pending_id": str(uuid4()),
+        "nft_number": gift.id,
+        "msg_id": msg.id,
+        "slug": slug,
+        "nft_name": gift.title or "",
+        "transfer_stars": getattr(gift, "transfer_price", None),
+        "link": f"https://t.me/nft/{slug}" if slug else None,
+        "used": False,
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+
+def _is_conflict(e) -> bool:
+    # 23505 unique_violation — запись уже вставил кто-то другой
+    return "23505" in str(e) or "duplicate key" in str(e)
+
+
+def store_gifts(rows):
+    """
+    Пакетная запись подарков одной страницы: один SELECT ... IN (...) на антидубль и один INSERT.
+    Антидубль — по msg_id независимо от used (одно сообщение = один подарок: в режиме демона его
+    пишет живой хендлер, а потом перечитывает catch_up, и за это время подарок могли уже выдать)
+    и по nft_number среди невыданных. Гонку двух сканеров закрывают уникальные индексы
+        create unique index gifts_for_cases_msg on gifts_for_cases (msg_id);
+        create unique index gifts_for_cases_unused_nft on gifts_for_cases (nft_number) where not used;
+    при конфликте пачки досылаем построчно, конфликтующие строки считаем пропущенными.
+    Возвращает (added, skipped); при иной ошибке бросает исключение — страница будет перечитана.
+    """
+    # антидубль внутри страницы: один и тот же nft_number мог прийти дважды
+    unique = {}
+    for row in rows:
+        unique.setdefault(row["nft_number"], row)
+    skipped = len(rows) - len(unique)
+
+    # антидубль по БД: это сообщение уже записано (used любой) или есть невыданная запись с тем же nft_number
+    msg_ids = ",".join(str(r["msg_id"]) for r in unique.values())
+    nfts = ",".join(str(n) for n in unique)
+    existing = supabase.table(TABLE) \
+        .select("nft_number,msg_id,used") \
+        .or_(f"msg_id.in.({msg_ids}),and(nft_number.in.({nfts}),used.is.false)") \
+        .execute()
+    by_msg = {row["msg_id"]: nft for nft, row in unique.items()}
+    for r in existing.data or []:
+        nft = by_msg.get(r["msg_id"])
+        if nft is not None and unique.pop(nft, None) is not None:
+            skipped += 1
+            print(f"⛔ msg_id={r['msg_id']} уже записан (used={r['used']}) — пропуск")
+        elif not r["used"] and unique.pop(r["nft_number"], None) is not None:
+            skipped += 1
+            print(f"⛔ {r['nft_number']} уже есть и не использован — пропуск")
+
+    new_rows = list(unique.values())
+    if not new_rows:
+        return 0, skipped
+
+    try:
+        supabase.table(TABLE).insert(new_rows).execute()
+        inserted = new_rows
+    except Exception as e:
+        if not _is_conflict(e):
+            raise
+        inserted = []
+        for row in new_rows:
+            try:
+                supabase.table(TABLE).insert(row).execute()
+                inserted.append(row)
+            except Exception as row_err:
+                if not _is_conflict(row_err):
+                    raise
+                skipped += 1
+                print(f"⛔ {row['nft_number']} вставлен параллельно — пропуск")
+
+    for row in inserted:
+        print(f"✅ Добавлен {row['nft_number']} — '{row['nft_name']}' (msg_id={row['msg_id']})")
+    return len(inserted), skipped
+
+
+async def catch_up(app: Client, checkpoint: int):
+    """Дочитывает историю после чекпоинта страницами. Возвращает (checkpoint, added, skipped)."""
+    added, skipped = 0, 0
+    while True:
+        page = await read_page_after(app, SECOND_USER_ID, checkpoint)
+        if not page:
+            break
+
+        rows = [r for r in (gift_row(m) for m in page) if r]
+        if rows:
+            try:
+                page_added, page_skipped = await asyncio.to_thread(store_gifts, rows)
+            except Exception as e:
+                # чекпоинт не двигаем — следующий проход перечитает эту страницу (антидубль защитит)
+                print(f"❌ Не удалось записать страницу после msg_id={checkpoint}: {e}")
+                break
+            added += page_added
+            skipped += page_skipped
+
+        checkpoint = page[-1].id
+        save_checkpoint(SECOND_USER_ID, checkpoint)
+        print(f"📄 Обработано до msg_id={checkpoint}: добавлено {added}, пропущено {skipped}")
+    return checkpoint, added, skipped
+
+
 async def scan_gifts_from_chat():
     app = Client(session_name, api_id, api_hash)
     await app.start()
@@ -49,60 +244,100 @@ async def scan_gifts_from_chat():
     # прогреваем peer, чтобы убрать ID not found
     await ensure_peer(app, SECOND_USER_ID)
 
-    added, skipped = 0, 0
+    checkpoint = load_checkpoint(SECOND_USER_ID)
+    if checkpoint is None:
+        checkpoint = await initial_checkpoint(app, SECOND_USER_ID)
+    print(f"📍 Чекпоинт: msg_id > {checkpoint}")
+    _, added, skipped = await catch_up(app, checkpoint)
+
+    await app.stop()
+    print(f"🏁 Скан завершён. Добавлено: {added}, пропущено: {skipped}")
+
+
+# ── Режим демона ────────────────────────────────────────────────
+# Одно постоянное MTProto-соединение: подарки из SECOND_USER_ID ловим хендлером по мере прихода,
+# копим в буфер и пишем пачкой раз в DAEMON_FLUSH_SEC (или по заполнении DAEMON_BATCH).
+# Чекпоинт двигает только периодический catch_up — он же подбирает то, что хендлер пропустил
+# (разрыв соединения, простой), а уже вставленное живым хендлером отсекает антидубль.
+DAEMON_FLUSH_SEC = float(os.getenv("SCAN_DAEMON_FLUSH_SEC", "2"))
+DAEMON_BATCH = int(os.getenv("SCAN_DAEMON_BATCH", "50"))
+CATCHUP_SEC = int(os.getenv("SCAN_CATCHUP_SEC", "300"))
+
+_live = {"rows": [], "event": None}
+
+gift_service = filters.create(lambda _, __, m: m.service == MessageServiceType.GIFT)
+
+
+async def on_gift(client, msg):
+    row = gift_row(msg)
+    if not row:
+        return
+    _live["rows"].append(row)
+    print(f"🎁 Новый подарок {row['nft_number']} (msg_id={row['msg_id']})")
+    if len(_live["rows"]) >= DAEMON_BATCH:
+        _live["event"].set()
 
-    async for msg in app.get_chat_history(chat_id=SECOND_USER_ID, limit=SCAN_LIMIT):
-        # интересуют только сервисные сообщения с подарками
-        if msg.service != MessageServiceType.GIFT:
-            continue
-        gift = getattr(msg, "gift", None)
-        if not gift:
-            continue
-
-        nft_number = gift.id
-        slug = gift.name or ""           # ключ для кейсов
-        nft_name = gift.title or ""
-        transfer_stars = getattr(gift, "transfer_price", None)
-        link = f"https://t.me/nft/{slug}" if slug else None
-        msg_id = msg.id
-
-        # антидубль: если уже есть запись с тем же nft_number и used=false — пропускаем
+
+async def flush_live():
+    rows, _live["rows"] = _live["rows"], []
+    if not rows:
+        return
+    try:
+        added, skipped = await asyncio.to_thread(store_gifts, rows)
+        print(f"💾 Записано: добавлено {added}, пропущено {skipped}")
+    except Exception as e:
+        print(f"❌ Не удалось записать {len(rows)} подарков, повторим: {e}")
+        _live["rows"][:0] = rows
+
+
+async def _flush_loop():
+    while True:
         try:
-            existing = supabase.table(TABLE)\
-                .select("nft_number, used")\
-                .eq("nft_number", nft_number)\
-                .execute()
+            await asyncio.wait_for(_live["event"].wait(), timeout=DAEMON_FLUSH_SEC)
+        except asyncio.TimeoutError:
+            pass
+        _live["event"].clear()
+        await flush_live()
 
-            if existing.data and any(not row.get("used") for row in existing.data):
-                skipped += 1
-                print(f"⛔ {nft_number} уже есть и не использован — пропуск")
-                continue
-        except Exception as e:
-            print(f"⚠️ Ошибка проверки дубля {nft_number}: {e}")
-            continue  # безопаснее пропустить, чем задвоить
-
-        insert_data = {
-            "pending_id": str(uuid4()),
-            "nft_number": nft_number,
-            "msg_id": msg_id,
-            "slug": slug,
-            "nft_name": nft_name,
-            "transfer_stars": transfer_stars,
-            "link": link,
-            "used": False,
-            "created_at": datetime.utcnow().isoformat()
-        }
 
+async def _catch_up_loop(app: Client):
+    checkpoint = load_checkpoint(SECOND_USER_ID)
+    if checkpoint is None:
+        checkpoint = await initial_checkpoint(app, SECOND_USER_ID)
+    while True:
         try:
-            supabase.table(TABLE).insert(insert_data).execute()
-            added += 1
-            print(f"✅ Добавлен {nft_number} — '{nft_name}' (msg_id={msg_id})")
+            checkpoint, added, skipped = await catch_up(app, checkpoint)
+            if added:
+                print(f"🔁 Catch-up: добавлено {added} пропущенных подарков")
         except Exception as e:
-            print(f"❌ Не удалось вставить {nft_number}: {e}")
+            print(f"⚠️ Ошибка catch-up: {e}")
+        await asyncio.sleep(CATCHUP_SEC)
+
 
+async def run_daemon():
+    app = Client(session_name, api_id, api_hash)
+    _live["event"] = asyncio.Event()
+    app.add_handler(MessageHandler(on_gift, filters.chat(SECOND_USER_ID) & gift_service))
+    await app.start()
+    await ensure_peer(app, SECOND_USER_ID)
+    print(f"🚀 Сканер подарков в режиме демона: слушаем {SECOND_USER_ID}")
+
+    tasks = [asyncio.create_task(_flush_loop()), asyncio.create_task(_catch_up_loop(app))]
+    await idle()  # до SIGINT/SIGTERM
+
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await flush_live()
     await app.stop()
-    print(f"🏁 Скан завершён. Добавлено: {added}, пропущено: {skipped}")
+    print("🏁 Демон остановлен")
 
 
 if __name__ == "__main__":
-    asyncio.run(scan_gifts_from_chat())
+    # python case_scanner.py           — разовый скан после чекпоинта (как для cron)
+    # python case_scanner.py --daemon  — постоянное соединение и приём подарков по мере прихода
+    # --backfill (при первом запуске, без чекпоинта) — прочитать историю чата с самого начала
+    if "--daemon" in sys.argv[1:] or os.getenv("SCAN_MODE") == "daemon":
+        asyncio.run(run_daemon())
+    else:
+        asyncio.run(scan_gifts_from_chat())
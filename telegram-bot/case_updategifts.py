@@ -1,8 +1,15 @@
 import os
+import sys
 import json
+import time
+import hashlib
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from pyrogram import Client
 from supabase import create_client, Client as SupabaseClient
-from lottie.parsers.tgs import parse_tgs
+from lottie_assets import convert_tgs, json_variants
+from color_index import ColorIndex
+from asset_bundle import build_bundle
 
 # ── Telegram API ─────────────────────────────────────────────────
 API_ID = 20572626
@@ -21,9 +28,30 @@ TABLE_NAME = "gifts_for_cases"
 ANIMATIONS_DIR = "C:/Users/PC/Desktop/frontend/fronted-server/public/animations"
 os.makedirs(ANIMATIONS_DIR, exist_ok=True)
 COLORS_FILE = os.path.join(ANIMATIONS_DIR, "colors.json")
+COLORS_DB = os.getenv(
+    "COLORS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gift_colors.sqlite")
+)
+# Манифест ассетов: slug → msg_id, file_unique_id стикера, размеры и sha256 файлов, готовые варианты.
+# Обновление сравнивает БД с манифестом и берёт в работу только новые/изменённые/битые slug'и;
+# файловую систему при этом не сканируем (проверка хэшей — по флагу --verify).
+MANIFEST_FILE = os.path.join(ANIMATIONS_DIR, "manifest.json")
+# ASSET_BUNDLE=1 — после прогона ещё и упаковать все файлы манифеста в один pack + индекс
+# (см. asset_bundle.py; пересобираются только изменившиеся файлы)
+ASSET_BUNDLE = os.getenv("ASSET_BUNDLE", "0") == "1"
 
 PNG_SIZE = 512  # размер PNG по большей стороне
 
+# Превью-лесенка для списков в мини-аппе: {slug}.{size}.{png|webp}; фронт берёт наименьшее подходящее
+# (какие есть — см. "renditions" в manifest.json). Пусто в RENDITION_SIZES — не делаем.
+RENDITION_SIZES = sorted(int(x) for x in os.getenv("RENDITION_SIZES", "64,128,256,512").split(",") if x.strip())
+RENDITION_FORMATS = [x.strip() for x in os.getenv("RENDITION_FORMATS", "png,webp").split(",") if x.strip()]
+RENDITION_WEBP_QUALITY = int(os.getenv("RENDITION_WEBP_QUALITY", "85"))
+
+# Конвейер: сетевые шаги (get_messages, download_media) идут параллельно, но не больше
+# FETCH_CONCURRENCY одновременно; CPU-шаги (.tgs → JSON, рендер PNG) — в пуле процессов.
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "8"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 2)))
+
 # ── Init Supabase ───────────────────────────────────────────────
 supabase: SupabaseClient = create_client(SUPABASE_URL, SUPABASE_KEY)
 
@@ -36,192 +64,463 @@ app = Client(
     ipv6=False
 )
 
-# ── Load existing colors.json ───────────────────────────────────
-if os.path.exists(COLORS_FILE):
-    with open(COLORS_FILE, "r", encoding="utf-8") as f:
-        colors_data = json.load(f)
-else:
-    colors_data = {}
+# ── Индекс цветов ───────────────────────────────────────────────
+# Открывается в main(): модуль заново импортируется воркерами пула процессов, им база не нужна.
+# При первом запуске импортирует существующий colors.json; в конце colors.json выгружается заново.
+colors_index: ColorIndex = None
 
-def render_png_from_tgs(tgs_path: str, png_path: str, size: int = PNG_SIZE) -> bool:
-    """Рендер первого кадра TGS → PNG (через lottie)."""
+def _export_frame(animation, png_path: str, size: int) -> bool:
+    """Рендер первого кадра уже разобранной анимации → PNG (через lottie)."""
     try:
-        animation = parse_tgs(tgs_path)
+        from lottie.exporters import png as lottie_png
+        lottie_png.export_png(animation, png_path, frame=0, width=size, height=size)
+        return True
+    except Exception:
         try:
-            from lottie.exporters import png as lottie_png
-            lottie_png.export_png(animation, png_path, frame=0, width=size, height=size)
+            from lottie.exporters import exporters
+            exporter = exporters.get("pillow")
+            exporter.export(animation, png_path, frame=0, width=size, height=size)
             return True
-        except Exception:
-            try:
-                from lottie.exporters import exporters
-                exporter = exporters.get("pillow")
-                exporter.export(animation, png_path, frame=0, width=size, height=size)
-                return True
-            except Exception as e2:
-                print(f"  ⚠ Не удалось отрендерить PNG через lottie: {e2}")
-                return False
+        except Exception as e2:
+            print(f"  ⚠ Не удалось отрендерить PNG через lottie: {e2}")
+            return False
+
+def parse_tgs(tgs_path: str):
+    # python-lottie нужен только для рендера PNG — импортируем лениво, JSON делается без него
+    from lottie.parsers.tgs import parse_tgs as lottie_parse_tgs
+    return lottie_parse_tgs(tgs_path)
+
+def render_png_from_tgs(tgs_path: str, png_path: str, size: int = PNG_SIZE) -> bool:
+    """Рендер первого кадра TGS → PNG (через lottie)."""
+    try:
+        return _export_frame(parse_tgs(tgs_path), png_path, size)
     except Exception as e:
         print(f"  ⚠ Ошибка parse_tgs: {e}")
         return False
 
-with app:
-    # Прогрев peer
-    try:
-        app.get_users(SOURCE_PEER)
-    except Exception:
-        pass
-
-    # 1) Берём подарки из БД
-    response = supabase.table(TABLE_NAME).select("nft_name,msg_id,slug").execute()
-    gifts = response.data or []
-    print(f"Найдено {len(gifts)} подарков в {TABLE_NAME}")
-
+def rendition_variants(max_size=None):
+    """Расширения превью-лесенки: "64.png", "64.webp", ... (для WEBM — не больше размера thumbnail)."""
+    return [f"{size}.{fmt}" for size in RENDITION_SIZES if max_size is None or size <= max_size
+            for fmt in RENDITION_FORMATS]
+
+def png_side(path: str) -> int:
+    """Большая сторона PNG (PIL читает только заголовок)."""
+    from PIL import Image
+    with Image.open(path) as img:
+        return max(img.size)
+
+def write_renditions(src_png: str, base: str, png_path: str = None, ladder: bool = True):
+    """
+    Из одного кадра src_png делаем лесенку {base}.{size}.{png|webp} (и, если задан, основной
+    png_path на PNG_SIZE). size — большая сторона, пропорции сохраняются (thumbnail у Telegram
+    бывает не квадратным). Каждый файл пишется атомарно. Возвращает список записанных расширений.
+    """
+    from PIL import Image
+    done = []
+    with Image.open(src_png) as frame:
+        frame = frame.convert("RGBA")
+        if png_path:
+            tmp = png_path + ".part.png"
+            img = frame.copy()
+            img.thumbnail((PNG_SIZE, PNG_SIZE), Image.LANCZOS)
+            img.save(tmp, "PNG", optimize=True)
+            os.replace(tmp, png_path)
+        for ext in (rendition_variants(max(frame.size)) if ladder else []):
+            size, fmt = ext.split(".")
+            path = f"{base}.{ext}"
+            tmp = f"{path}.part.{fmt}"
+            img = frame.copy()
+            img.thumbnail((int(size), int(size)), Image.LANCZOS)
+            if fmt == "webp":
+                img.save(tmp, "WEBP", quality=RENDITION_WEBP_QUALITY, method=6)
+            else:
+                img.save(tmp, "PNG", optimize=True)
+            os.replace(tmp, path)
+            done.append(ext)
+    return done
+
+def build_from_tgs(tgs_path: str, base: str, need_json: bool, need_png: bool, need_renditions: bool):
+    """
+    Все CPU-шаги одного TGS (выполняется в пуле процессов): Lottie JSON напрямую из gzip
+    (lottie_assets.convert_tgs), а основной PNG (если нет thumbnail) и превью-лесенка —
+    из одного parse_tgs и одного отрендеренного кадра.
+    Возвращает {"error", "stats", "json", "png", "renditions"} — json/renditions: записанные расширения.
+    """
+    result = {"error": None, "stats": None, "json": [], "png": False, "renditions": []}
+    if need_json:
+        try:
+            # минифицированный JSON + .json.gz/.json.br рядом; каждый файл пишется атомарно
+            result["stats"] = convert_tgs(tgs_path, base + ".json")
+            result["json"] = json_variants()
+        except Exception as conv_err:
+            result["error"] = str(conv_err)
+    if need_png or need_renditions:
+        try:
+            animation = parse_tgs(tgs_path)
+        except Exception as e:
+            result["error"] = f"parse_tgs: {e}"
+            return result
+        # рендерим кадр один раз в наибольшем нужном размере, дальше только ресайз
+        frame = base + ".frame.part.png"
+        if _export_frame(animation, frame, max([PNG_SIZE, *RENDITION_SIZES])):
+            try:
+                result["renditions"] = write_renditions(
+                    frame, base, base + ".png" if need_png else None, ladder=need_renditions)
+                result["png"] = need_png
+            except Exception as e:
+                result["error"] = f"renditions: {e}"
+            finally:
+                os.remove(frame)
+    return result
+
+# ── Манифест ────────────────────────────────────────────────────
+def load_manifest():
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest):
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, MANIFEST_FILE)
+
+def file_info(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return {"size": os.path.getsize(path), "sha256": h.hexdigest()}
+
+# какие варианты обязательны, чтобы slug считался готовым
+# (смена LOTTIE_PRECOMPRESS добавит недостающие сжатые копии при следующем запуске).
+# Превью-лесенка для TGS — до "rendition_max" записи: лесенка из маленького thumbnail
+# не дотягивает до больших размеров, и требовать их значило бы перекачивать slug каждый раз.
+REQUIRED_VARIANTS = {"tgs": ("tgs", *json_variants(), "png"), "webm": ("webm",)}
+
+def entry_complete(entry, msg_id) -> bool:
+    if not entry or str(entry.get("msg_id")) != str(msg_id):
+        return False
+    files = entry.get("files", {})
+    required = list(REQUIRED_VARIANTS.get(entry.get("kind"), ("json", "png")))
+    if entry.get("kind") == "tgs":
+        required += rendition_variants(entry.get("rendition_max"))
+    return all(v in files for v in required)
+
+def entry_intact(slug, entry) -> bool:
+    """--verify: все записанные файлы на месте и совпадают по размеру и sha256."""
+    for ext, info in entry.get("files", {}).items():
+        path = os.path.join(ANIMATIONS_DIR, f"{slug}.{ext}")
+        if not os.path.exists(path) or os.path.getsize(path) != info["size"] or file_info(path) != info:
+            return False
+    return True
+
+def _thumb_file_id(sticker_obj):
+    if getattr(sticker_obj, "thumb", None):
+        return sticker_obj.thumb.file_id
+    if getattr(sticker_obj, "thumbs", None):
+        thumbs = sticker_obj.thumbs or []
+        if thumbs:
+            return thumbs[0].file_id
+    return None
+
+MESSAGES_BATCH = 200  # максимум id в одном get_messages
+
+def select_todo(gifts, manifest, verify=False, recheck=False):
+    """
+    Только подарки, которые реально надо обрабатывать: по одному на slug, с msg_id,
+    и без полной записи в манифесте (или с битыми файлами при verify).
+    recheck — берём все slug'и: сообщения перечитываются, а файлы переиспользуются,
+    если file_unique_id стикера не изменился.
+    """
+    todo, seen = [], set()
     for gift in gifts:
-        nft_name = gift.get("nft_name")
         msg_id = gift.get("msg_id")
         slug = gift.get("slug")
-
         if not msg_id:
             print(f"⏭️ Пропуск: нет msg_id (slug={slug})")
             continue
+        if slug in seen:
+            continue  # один slug — одни файлы; несколько строк одного подарка обрабатываем один раз
+        seen.add(slug)
 
-        print(f"\n✨ Обработка: {slug} (msg_id={msg_id})")
-
-        base = os.path.join(ANIMATIONS_DIR, slug)
-        tgs_path  = base + ".tgs"
-        webm_path = base + ".webm"
-        json_path = base + ".json"
-        png_path  = base + ".png"
-
-        # Если PNG и JSON уже есть — пропуск
-        if os.path.exists(png_path) and os.path.exists(json_path):
-            print(f"⏭️ Уже есть PNG и Lottie: {png_path}, {json_path}")
+        entry = manifest.get(slug)
+        if recheck:
+            todo.append(gift)
+            continue
+        if entry_complete(entry, msg_id) and (not verify or entry_intact(slug, entry)):
             continue
+        if entry and verify and entry_complete(entry, msg_id):
+            print(f"🩹 [{slug}] файлы повреждены — перегенерируем")
+        todo.append(gift)
+    return todo
+
+async def fetch_messages(msg_ids, fetch_sem):
+    """Пакетно получаем сообщения (multi-id get_messages) → {msg_id: message}."""
+    ids = sorted({int(x) for x in msg_ids})
+    batches = [ids[i:i + MESSAGES_BATCH] for i in range(0, len(ids), MESSAGES_BATCH)]
+
+    async def fetch(batch):
+        async with fetch_sem:
+            return await app.get_messages(SOURCE_PEER, batch)
+
+    out = {}
+    for msgs in await asyncio.gather(*(fetch(b) for b in batches)):
+        for m in msgs or []:
+            if m and not getattr(m, "empty", False):
+                out[m.id] = m
+    print(f"📨 Получено {len(out)} сообщений за {len(batches)} запрос(ов)")
+    return out
+
+async def process_gift(gift, message, fetch_sem, pool, manifest):
+    msg_id = gift.get("msg_id")
+    slug = gift.get("slug")
+    loop = asyncio.get_running_loop()
+
+    base = os.path.join(ANIMATIONS_DIR, slug)
+    tgs_path  = base + ".tgs"
+    webm_path = base + ".webm"
+    json_path = base + ".json"
+    png_path  = base + ".png"
+
+    print(f"✨ Обработка: {slug} (msg_id={msg_id})")
 
-        try:
-            message = app.get_messages(SOURCE_PEER, int(msg_id))
-            if not message or not getattr(message, "gift", None):
-                print("  ❌ Нет подарка в сообщении!")
-                continue
-
-            # 1) Пытаемся как раньше: attributes -> MODEL.sticker
-            attrs = getattr(message.gift, "attributes", []) or []
-            model_attr = next((a for a in attrs if getattr(getattr(a, "type", None), "name", "") == "MODEL"), None)
-            backdrop_attr = next((a for a in attrs if getattr(getattr(a, "type", None), "name", "") == "BACKDROP"), None)
-
-            sticker_obj = None
-            sticker_source = None
-
-            if model_attr and getattr(model_attr, "sticker", None):
-                sticker_obj = model_attr.sticker
-                sticker_source = "MODEL.sticker"
-            # 2) ФОЛЛБЭК: обычные (рыночные) подарки → gift.sticker
-            elif getattr(message.gift, "sticker", None):
-                sticker_obj = message.gift.sticker
-                sticker_source = "gift.sticker"
-
-            if not sticker_obj or not getattr(sticker_obj, "file_id", None):
-                print("  ❌ Нет sticker.file_id ни в MODEL.sticker, ни в gift.sticker — нечего скачивать")
-                continue
-
-            mime = (getattr(sticker_obj, "mime_type", "") or "").lower()
-            file_id = sticker_obj.file_id
-            print(f"  ℹ Источник стикера: {sticker_source} | mime={mime or 'unknown'}")
-
-            # ── Ветка А: TGS (application/x-tgsticker)
-            is_tgs = "x-tgsticker" in mime or file_id.endswith(".tgs")  # на всякий
-            if is_tgs:
-                # 2) Скачиваем .tgs
-                if not os.path.exists(tgs_path):
-                    app.download_media(file_id, file_name=tgs_path)
+    try:
+        if not message or not getattr(message, "gift", None):
+            print(f"  ❌ [{slug}] Нет подарка в сообщении!")
+            return
+
+        # 1) Пытаемся как раньше: attributes -> MODEL.sticker
+        attrs = getattr(message.gift, "attributes", []) or []
+        model_attr = next((a for a in attrs if getattr(getattr(a, "type", None), "name", "") == "MODEL"), None)
+        backdrop_attr = next((a for a in attrs if getattr(getattr(a, "type", None), "name", "") == "BACKDROP"), None)
+
+        sticker_obj = None
+        sticker_source = None
+
+        if model_attr and getattr(model_attr, "sticker", None):
+            sticker_obj = model_attr.sticker
+            sticker_source = "MODEL.sticker"
+        # 2) ФОЛЛБЭК: обычные (рыночные) подарки → gift.sticker
+        elif getattr(message.gift, "sticker", None):
+            sticker_obj = message.gift.sticker
+            sticker_source = "gift.sticker"
+
+        if not sticker_obj or not getattr(sticker_obj, "file_id", None):
+            print(f"  ❌ [{slug}] Нет sticker.file_id ни в MODEL.sticker, ни в gift.sticker — нечего скачивать")
+            return
+
+        mime = (getattr(sticker_obj, "mime_type", "") or "").lower()
+        file_id = sticker_obj.file_id
+        unique_id = getattr(sticker_obj, "file_unique_id", None)
+        print(f"  ℹ [{slug}] Источник стикера: {sticker_source} | mime={mime or 'unknown'}")
+
+        thumb_file_id = _thumb_file_id(sticker_obj)
+
+        # старые файлы переиспользуем, только если стикер тот же и файл совпадает с манифестом
+        old = manifest.get(slug) or {}
+        same_sticker = unique_id is not None and old.get("file_unique_id") == unique_id
+        if old and not same_sticker:
+            print(f"  🔄 [{slug}] стикер изменился — пересобираем все варианты")
+
+        def reusable(ext, path):
+            info = old.get("files", {}).get(ext)
+            return same_sticker and info and os.path.exists(path) and os.path.getsize(path) == info["size"]
+
+        async def download(fid, path):
+            tmp = path + ".part"
+            async with fetch_sem:
+                await app.download_media(fid, file_name=tmp)
+            os.replace(tmp, path)  # файл появляется под своим именем только целиком
+
+        files = {}
+        # наибольший достижимый размер превью: None — полная лесенка (рендер), иначе размер thumbnail
+        rendition_max = old.get("rendition_max") if same_sticker else None
+
+        # ── Ветка А: TGS (application/x-tgsticker)
+        is_tgs = "x-tgsticker" in mime or file_id.endswith(".tgs")  # на всякий
+        if is_tgs:
+            # 2) Скачиваем .tgs и (параллельно) thumbnail
+            async def fetch_tgs():
+                if not reusable("tgs", tgs_path):
+                    await download(file_id, tgs_path)
                     print(f"  ✅ Скачан: {tgs_path}")
                 else:
                     print(f"  ⏭️ Уже есть TGS: {tgs_path}")
 
-                # 3) Конвертируем .tgs → .json
-                if not os.path.exists(json_path):
-                    try:
-                        animation = parse_tgs(tgs_path)
-                        with open(json_path, "w", encoding="utf-8") as out:
-                            json.dump(animation.to_dict(), out, ensure_ascii=False, indent=2)
-                        print(f"  ✅ Конвертирован в: {json_path}")
-                    except Exception as conv_err:
-                        print(f"  ⚠ Ошибка при конвертации .tgs: {conv_err}")
-                else:
-                    print(f"  ⏭️ Уже есть Lottie: {json_path}")
-
-                # 4) PNG: thumbnail → render
-                png_done = False
-                thumb_file_id = None
-                if getattr(sticker_obj, "thumb", None):
-                    thumb_file_id = sticker_obj.thumb.file_id
-                elif getattr(sticker_obj, "thumbs", None):
-                    thumbs = sticker_obj.thumbs or []
-                    if thumbs:
-                        thumb_file_id = thumbs[0].file_id
-
-                if thumb_file_id:
-                    try:
-                        app.download_media(thumb_file_id, file_name=png_path)
-                        print(f"  ✅ PNG (thumbnail): {png_path}")
-                        png_done = True
-                    except Exception as e_dl:
-                        print(f"  ⚠ Не удалось скачать thumbnail: {e_dl}")
-
-                if not png_done:
-                    if render_png_from_tgs(tgs_path, png_path, PNG_SIZE):
-                        print(f"  ✅ PNG (rendered): {png_path}")
-                    else:
-                        print("  ❌ PNG не удалось получить (ни thumbnail, ни рендер)")
-
-            # ── Ветка B: WEBM (video/webm — видео-стикер)
+            async def fetch_thumb():
+                if reusable("png", png_path):
+                    return True
+                if not thumb_file_id:
+                    return False
+                try:
+                    await download(thumb_file_id, png_path)
+                    print(f"  ✅ PNG (thumbnail): {png_path}")
+                    return True
+                except Exception as e_dl:
+                    print(f"  ⚠ [{slug}] Не удалось скачать thumbnail: {e_dl}")
+                    return False
+
+            _, png_done = await asyncio.gather(fetch_tgs(), fetch_thumb())
+            files["tgs"] = file_info(tgs_path)
+
+            # 3) Один проход в пуле процессов: .tgs → .json, PNG (если нет thumbnail), превью-лесенка.
+            # В манифест идут только переиспользованные и записанные в этом прогоне варианты: файлы
+            # от прежнего стикера могут лежать рядом, но к новому file_unique_id отношения не имеют.
+            need_json = not all(reusable(ext, f"{base}.{ext}") for ext in json_variants())
+            need_renditions = not all(reusable(ext, f"{base}.{ext}") for ext in rendition_variants(rendition_max))
+            produced = [] if need_json else json_variants()
+            if not need_renditions:
+                produced += rendition_variants(rendition_max)
+            if not need_json:
+                print(f"  ⏭️ Уже есть Lottie: {json_path}")
+            rendered = []
+            if need_json or not png_done or need_renditions:
+                built = await loop.run_in_executor(
+                    pool, build_from_tgs, tgs_path, base, need_json, not png_done, need_renditions)
+                if built["error"]:
+                    print(f"  ⚠ [{slug}] Ошибка при обработке .tgs: {built['error']}")
+                if built["stats"]:
+                    stats = built["stats"]
+                    print(f"  ✅ Конвертирован в: {json_path} "
+                          f"({stats['bytes_before']} → {stats['bytes_after']} байт, "
+                          f"ключей выкинуто: {stats['keyframes_dropped']})")
+                if built["png"]:
+                    print(f"  ✅ PNG (rendered): {png_path}")
+                    png_done = True
+                if built["renditions"]:
+                    print(f"  ✅ Превью: {', '.join(built['renditions'])}")
+                    rendition_max = None
+                rendered = built["renditions"]
+                produced += built["json"] + rendered
+
+            if not png_done:
+                print(f"  ❌ [{slug}] PNG не удалось получить (ни thumbnail, ни рендер)")
+            elif need_renditions and not rendered:
+                # рендер не удался — лесенка хотя бы из thumbnail (только размеры не больше него)
+                try:
+                    rendition_max = png_side(png_path)
+                    built = await loop.run_in_executor(pool, write_renditions, png_path, base)
+                    print(f"  ✅ Превью (из thumbnail): {', '.join(built) or '—'}")
+                    produced += built
+                except Exception as e_r:
+                    print(f"  ⚠ [{slug}] Превью не сделаны: {e_r}")
+
+            for ext in produced:
+                files[ext] = file_info(f"{base}.{ext}")
+            if png_done:
+                files["png"] = file_info(png_path)
+
+        # ── Ветка B: WEBM (video/webm — видео-стикер)
+        else:
+            if not reusable("webm", webm_path):
+                await download(file_id, webm_path)
+                print(f"  ✅ Скачан: {webm_path}")
             else:
-                if not os.path.exists(webm_path):
-                    app.download_media(file_id, file_name=webm_path)
-                    print(f"  ✅ Скачан: {webm_path}")
-                else:
-                    print(f"  ⏭️ Уже есть WEBM: {webm_path}")
-
-                # Попытка PNG из thumbnail, если телега его отдаёт
-                png_done = False
-                thumb_file_id = None
-                if getattr(sticker_obj, "thumb", None):
-                    thumb_file_id = sticker_obj.thumb.file_id
-                elif getattr(sticker_obj, "thumbs", None):
-                    thumbs = sticker_obj.thumbs or []
-                    if thumbs:
-                        thumb_file_id = thumbs[0].file_id
-                if thumb_file_id:
+                print(f"  ⏭️ Уже есть WEBM: {webm_path}")
+            files["webm"] = file_info(webm_path)
+
+            # Попытка PNG из thumbnail, если телега его отдаёт
+            png_done = png_reused = reusable("png", png_path)
+            if not png_done and thumb_file_id:
+                try:
+                    await download(thumb_file_id, png_path)
+                    print(f"  ✅ PNG (thumbnail): {png_path}")
+                    png_done = True
+                except Exception as e_dl:
+                    print(f"  ⚠ [{slug}] Не удалось скачать thumbnail: {e_dl}")
+            if png_done:
+                files["png"] = file_info(png_path)
+                rendition_max = png_side(png_path)
+                # thumbnail может быть меньше 512 — тогда лесенка неполная, поэтому проверяем «хоть что-то есть»
+                produced = [ext for ext in rendition_variants() if reusable(ext, f"{base}.{ext}")]
+                if not png_reused or not produced:
                     try:
-                        app.download_media(thumb_file_id, file_name=png_path)
-                        print(f"  ✅ PNG (thumbnail): {png_path}")
-                        png_done = True
-                    except Exception as e_dl:
-                        print(f"  ⚠ Не удалось скачать thumbnail: {e_dl}")
-                if not png_done:
-                    print("  ℹ WEBM без thumbnail: PNG не формируем (нужен ffmpeg, можно добавить позже)")
-
-                # для WEBM лотти JSON не делаем
-                if os.path.exists(json_path):
-                    pass
-                else:
-                    print("  ℹ Lottie JSON не создаётся для WEBM")
-
-            # 5) Цвета BACKDROP (только если есть)
-            if backdrop_attr:
-                colors_data[slug] = {
-                    "center_color": f"#{backdrop_attr.center_color:06x}",
-                    "edge_color": f"#{backdrop_attr.edge_color:06x}",
-                    "pattern_color": f"#{backdrop_attr.pattern_color:06x}",
-                    "text_color": f"#{backdrop_attr.text_color:06x}"
-                }
-                print(f"  ✨ Цвета сохранены: {colors_data[slug]}")
+                        produced = await loop.run_in_executor(pool, write_renditions, png_path, base)
+                        print(f"  ✅ Превью (из thumbnail): {', '.join(produced) or '—'}")
+                    except Exception as e_r:
+                        produced = []
+                        print(f"  ⚠ [{slug}] Превью не сделаны: {e_r}")
+                for ext in produced:
+                    files[ext] = file_info(f"{base}.{ext}")
+            else:
+                print(f"  ℹ [{slug}] WEBM без thumbnail: PNG не формируем (нужен ffmpeg, можно добавить позже)")
+
+            # для WEBM лотти JSON не делаем
+            print(f"  ℹ [{slug}] Lottie JSON не создаётся для WEBM")
+
+        # 5) Цвета BACKDROP (только если есть)
+        if backdrop_attr:
+            colors = {
+                "center_color": f"#{backdrop_attr.center_color:06x}",
+                "edge_color": f"#{backdrop_attr.edge_color:06x}",
+                "pattern_color": f"#{backdrop_attr.pattern_color:06x}",
+                "text_color": f"#{backdrop_attr.text_color:06x}"
+            }
+            colors_index.put(slug, colors)  # сразу на диск, одной строкой
+            print(f"  ✨ [{slug}] Цвета сохранены: {colors}")
+
+        # 6) Запись в манифест — только переиспользованное и записанное в этом прогоне
+        manifest[slug] = {
+            "msg_id": int(msg_id),
+            "file_unique_id": unique_id,
+            "kind": "tgs" if is_tgs else "webm",
+            "files": files,
+            "variants": sorted(files),
+            "renditions": {fmt: [int(ext.split(".")[0]) for ext in rendition_variants() if ext in files
+                                 and ext.endswith("." + fmt)] for fmt in RENDITION_FORMATS},
+            "rendition_max": rendition_max,
+            "updated_at": int(time.time()),
+        }
 
-        except Exception as e:
-            print(f"  ❌ Ошибка при обработке {slug}: {e}")
+    except Exception as e:
+        print(f"  ❌ Ошибка при обработке {slug}: {e}")
+
+async def main():
+    global colors_index
+    colors_index = ColorIndex(COLORS_DB, legacy_json=COLORS_FILE)
+
+    async with app:
+        # Прогрев peer
+        try:
+            await app.get_users(SOURCE_PEER)
+        except Exception:
+            pass
+
+        # 1) Берём подарки из БД
+        response = supabase.table(TABLE_NAME).select("nft_name,msg_id,slug").execute()
+        gifts = response.data or []
+        print(f"Найдено {len(gifts)} подарков в {TABLE_NAME}")
+
+        manifest = load_manifest()
+        args = sys.argv[1:]
+        todo = select_todo(gifts, manifest, verify="--verify" in args, recheck="--recheck" in args)
+        print(f"К обработке: {len(todo)} (в манифесте: {len(manifest)})")
+        if todo:
+            fetch_sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+            messages = await fetch_messages([g["msg_id"] for g in todo], fetch_sem)
+            with ProcessPoolExecutor(max_workers=CPU_WORKERS) as pool:
+                await asyncio.gather(*(
+                    process_gift(g, messages.get(int(g["msg_id"])), fetch_sem, pool, manifest) for g in todo
+                ))
+            save_manifest(manifest)
+
+        if ASSET_BUNDLE:
+            # бандл — дополнительный артефакт: его ошибка не должна сорвать выгрузку colors.json
+            try:
+                index, stats = build_bundle(ANIMATIONS_DIR, manifest)
+                print(f"📦 Бандл {index['pack']}: +{stats['added']} ={stats['kept']} -{stats['removed']}"
+                      f"{' (перепакован)' if stats['compacted'] else ''}")
+            except Exception as e:
+                print(f"❌ Бандл не собран: {e}")
+
+    # Выгружаем colors.json для фронта (атомарно)
+    print(f"🎨 colors.json: {colors_index.export_json(COLORS_FILE)} slug'ов")
+    colors_index.close()
 
-# Сохраняем colors.json
-with open(COLORS_FILE, "w", encoding="utf-8") as f:
-    json.dump(colors_data, f, ensure_ascii=False, indent=2)
+    print("\n✅ Готово! Стикеры (.tgs/.webm), Lottie (.json для TGS), PNG (thumbnail/рендер) и цвета сохранены.")
 
-print("\n✅ Готово! Стикеры (.tgs/.webm), Lottie (.json для TGS), PNG (thumbnail/рендер) и цвета сохранены.")
+# под guard'ом: пул процессов на Windows (spawn) заново импортирует этот модуль
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import sqlite3
+
+# Индекс цветов BACKDROP по slug'ам (SQLite вместо переписывания всего colors.json).
+# Каждый upsert — отдельная транзакция: падение посреди прогона теряет максимум текущий slug,
+# а WAL + busy_timeout позволяют нескольким апдейтерам писать одновременно, не затирая друг друга.
+# Для фронта по-прежнему выгружается colors.json (export_json — атомарно через tmp + os.replace).
+
+COLOR_FIELDS = ("center_color", "edge_color", "pattern_color", "text_color")
+
+
+class ColorIndex:
+    def __init__(self, path, legacy_json=None):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS gift_colors ("
+            " slug TEXT PRIMARY KEY,"
+            " center_color TEXT, edge_color TEXT, pattern_color TEXT, text_color TEXT,"
+            " updated_at INTEGER)"
+        )
+        self.conn.commit()
+        if legacy_json and os.path.exists(legacy_json) and not self.count():
+            self._import_json(legacy_json)
+
+    def _import_json(self, path):
+        # одноразовая миграция: старый colors.json → индекс
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self.conn:
+            for slug, colors in data.items():
+                self._upsert(slug, colors)
+        print(f"🎨 Импортировано цветов из {path}: {len(data)}")
+
+    def _upsert(self, slug, colors):
+        self.conn.execute(
+            "INSERT INTO gift_colors (slug, center_color, edge_color, pattern_color, text_color, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(slug) DO UPDATE SET center_color=excluded.center_color, edge_color=excluded.edge_color,"
+            " pattern_color=excluded.pattern_color, text_color=excluded.text_color, updated_at=excluded.updated_at",
+            (slug, *(colors.get(k) for k in COLOR_FIELDS), int(time.time())),
+        )
+
+    def put(self, slug, colors):
+        """O(1): одна строка, один commit."""
+        with self.conn:
+            self._upsert(slug, colors)
+
+    def get(self, slug):
+        row = self.conn.execute(
+            f"SELECT {', '.join(COLOR_FIELDS)} FROM gift_colors WHERE slug = ?", (slug,)
+        ).fetchone()
+        return dict(zip(COLOR_FIELDS, row)) if row else None
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM gift_colors").fetchone()[0]
+
+    def export_json(self, path):
+        rows = self.conn.execute(f"SELECT slug, {', '.join(COLOR_FIELDS)} FROM gift_colors ORDER BY slug")
+        data = {r[0]: dict(zip(COLOR_FIELDS, r[1:])) for r in rows}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+        return len(data)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lottie_assets import read_tgs, convert_tgs, dump_lottie
+
+# Бенчмарк конвертации .tgs → JSON: прямой путь (gzip + json) против parse_tgs(...).to_dict().
+# Запуск: python bench_convert.py gift.tgs pattern.tgs [--repeat 20]
+
+args = sys.argv[1:]
+repeat = 20
+if "--repeat" in args:
+    i = args.index("--repeat")
+    repeat = int(args[i + 1])
+    del args[i:i + 2]
+files = args or ["gift.tgs", "pattern.tgs"]
+
+
+def bench(name, fn):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in files:
+            fn(path)
+    elapsed = time.perf_counter() - started
+    total = repeat * len(files)
+    print(f"{name:<28} {elapsed / total * 1000:8.2f} ms/файл  {total / elapsed:8.1f} файлов/с")
+    return elapsed
+
+
+direct = bench("gzip+json (read_tgs)", lambda p: dump_lottie(read_tgs(p)))
+bench("gzip+json + оптимизатор", lambda p: convert_tgs(p, "_bench.json"))
+for ext in ("", ".gz", ".br"):
+    if os.path.exists("_bench.json" + ext):
+        os.remove("_bench.json" + ext)
+
+try:
+    from lottie.parsers.tgs import parse_tgs
+except ImportError:
+    print("python-lottie не установлен — старый путь не измерен")
+else:
+    old = bench("parse_tgs().to_dict()", lambda p: dump_lottie(parse_tgs(p).to_dict()))
+    print(f"ускорение: ×{old / direct:.1f}")
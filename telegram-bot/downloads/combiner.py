@@ -1,26 +1,203 @@
+import os
 import json
+import re
+import copy
+import time
+import argparse
 
-with open("gift.json", "r", encoding="utf-8") as f1, open("pattern.json", "r", encoding="utf-8") as f2:
-    gift = json.load(f1)
-    pattern = json.load(f2)
-
-# Объединим слои (pattern должен идти первым)
-combined_layers = pattern["layers"] + gift["layers"]
-
-# Создаем финальный JSON
-combined = {
-    "v": gift.get("v", "5.5.2"),
-    "fr": gift.get("fr", 60),
-    "ip": gift.get("ip", 0),
-    "op": gift.get("op", 180),
-    "w": gift.get("w", 512),
-    "h": gift.get("h", 512),
-    "ddd": 0,
-    "assets": [],
-    "layers": combined_layers
-}
-
-with open("combined.json", "w", encoding="utf-8") as f:
-    json.dump(combined, f, ensure_ascii=False, indent=2)
-
-print("✅ Файл combined.json создан")
+# Пакетный компоновщик: один паттерн + много подарков → по combined-анимации на slug.
+#   python combiner.py                                  — как раньше: pattern.json + gift.json → combined.json
+#   python combiner.py --pattern pattern.json --all     — все slug'и из ANIMATIONS_DIR (есть {slug}.json)
+#   python combiner.py --pattern pattern.json slug1 slug2 --recolor --backdrop
+# Слои паттерна разбираются и сериализуются один раз; каждый подарок читается по одному и
+# пишется потоково (шапка → слои паттерна → слои подарка), так что память не растёт с числом slug'ов.
+# --recolor   — заливки/обводки паттерна в pattern_color из colors.json
+# --backdrop  — подложка: радиальный градиент center_color → edge_color из colors.json
+
+ANIMATIONS_DIR = os.getenv("ANIMATIONS_DIR", "C:/Users/PC/Desktop/frontend/fronted-server/public/animations")
+COMBINED_DIR = os.getenv("COMBINED_DIR", os.path.join(ANIMATIONS_DIR, "combined"))
+
+_COLOR_MARK = "__PATTERN_COLOR_{}__"  # на эти места в кэше паттерна подставляется цвет конкретного slug'а
+_COLOR_MARK_RE = re.compile(r'"__PATTERN_COLOR_(\d+)__"')
+_ASSET_PREFIX = "pattern_"            # префикс id ассетов паттерна, чтобы не совпасть с ассетами подарка
+
+
+def hex_to_rgba(value):
+    v = value.lstrip("#")
+    return [round(int(v[i:i + 2], 16) / 255, 3) for i in (0, 2, 4)] + [1]
+
+
+def _dump(o):
+    return json.dumps(o, ensure_ascii=False, separators=(",", ":"))
+
+
+class PatternCache:
+    """
+    Слои паттерна, сериализованные один раз; для --recolor цвет подставляется строковой заменой.
+    Каждая метка помнит исходный цвет — без pattern_color у slug'а возвращается он.
+    Ассеты паттерна (precomp/картинки) переименовываются в pattern_<id> и уходят в шапку результата.
+    """
+
+    def __init__(self, path, recolor=False):
+        with open(path, "r", encoding="utf-8") as f:
+            pattern = json.load(f)
+        layers, self.assets = pattern["layers"], pattern.get("assets", [])
+        if self.assets or recolor:
+            layers, self.assets = copy.deepcopy(layers), copy.deepcopy(self.assets)
+        self._rename_assets(layers)
+        self.originals = []
+        if recolor:
+            self._mark_colors(layers)
+            self._mark_colors(self.assets)
+        self.max_ind = max((l.get("ind", 0) for l in layers), default=0)
+        self.text = ",".join(_dump(l) for l in layers)
+        self.recolor = recolor
+
+    def _rename_assets(self, layers):
+        ids = {a["id"]: _ASSET_PREFIX + str(a["id"]) for a in self.assets if "id" in a}
+        if not ids:
+            return
+
+        def walk(o):
+            if isinstance(o, list):
+                for v in o:
+                    walk(v)
+            elif isinstance(o, dict):
+                if o.get("refId") in ids:
+                    o["refId"] = ids[o["refId"]]
+                for v in o.values():
+                    walk(v)
+
+        for a in self.assets:
+            if "id" in a:
+                a["id"] = ids[a["id"]]
+        walk(layers)
+        walk(self.assets)
+
+    def _mark_colors(self, o):
+        if isinstance(o, list):
+            for v in o:
+                self._mark_colors(v)
+        elif isinstance(o, dict):
+            if o.get("ty") in ("fl", "st") and isinstance(o.get("c"), dict) and not o["c"].get("a"):
+                self.originals.append(_dump(o["c"]["k"]))
+                o["c"]["k"] = _COLOR_MARK.format(len(self.originals) - 1)
+            for v in o.values():
+                self._mark_colors(v)
+
+    def _fill(self, text, color):
+        # color=None — вернуть каждой метке её исходный цвет
+        return _COLOR_MARK_RE.sub(lambda m: color or self.originals[int(m.group(1))], text)
+
+    def layers_text(self, colors):
+        if not self.originals:
+            return self.text
+        color = colors.get("pattern_color") if colors else None
+        return self._fill(self.text, _dump(hex_to_rgba(color)) if color else None)
+
+    def assets_for(self, colors):
+        """Ассеты паттерна (с подставленным цветом) — для шапки combined."""
+        if not self.assets or not self.originals:
+            return self.assets
+        color = colors.get("pattern_color") if colors else None
+        return json.loads(self._fill(_dump(self.assets), _dump(hex_to_rgba(color)) if color else None))
+
+
+def backdrop_layer(colors, w, h, ip, op, ind):
+    """Нижний слой: прямоугольник на всю композицию с радиальным градиентом center → edge."""
+    c, e = hex_to_rgba(colors["center_color"]), hex_to_rgba(colors["edge_color"])
+    return {
+        "ty": 4, "ind": ind, "ip": ip, "op": op, "st": 0,
+        "ks": {"a": {"a": 0, "k": [0, 0]}, "p": {"a": 0, "k": [0, 0]}, "s": {"a": 0, "k": [100, 100]},
+               "r": {"a": 0, "k": 0}, "o": {"a": 0, "k": 100}},
+        "shapes": [{"ty": "gr", "it": [
+            {"ty": "rc", "p": {"a": 0, "k": [w / 2, h / 2]}, "s": {"a": 0, "k": [w, h]}, "r": {"a": 0, "k": 0}},
+            {"ty": "gf", "t": 2, "o": {"a": 0, "k": 100}, "r": 1,
+             "s": {"a": 0, "k": [w / 2, h / 2]}, "e": {"a": 0, "k": [w, h / 2]},
+             "h": {"a": 0, "k": 0}, "a": {"a": 0, "k": 0},
+             "g": {"p": 2, "k": {"a": 0, "k": [0, *c[:3], 1, *e[:3]]}}},
+            {"ty": "tr", "p": {"a": 0, "k": [0, 0]}, "a": {"a": 0, "k": [0, 0]}, "s": {"a": 0, "k": [100, 100]},
+             "r": {"a": 0, "k": 0}, "o": {"a": 0, "k": 100}},
+        ]}],
+    }
+
+
+def _shift_ind(layer, offset):
+    # индексы слоёв подарка сдвигаем за паттерн, иначе parent'ы начнут ссылаться на слои паттерна
+    if "ind" in layer:
+        layer["ind"] += offset
+    if "parent" in layer:
+        layer["parent"] += offset
+    return layer
+
+
+def combine(pattern, gift_path, out_path, colors=None, backdrop=False):
+    with open(gift_path, "r", encoding="utf-8") as f:
+        gift = json.load(f)
+
+    w, h = gift.get("w", 512), gift.get("h", 512)
+    ip, op = gift.get("ip", 0), gift.get("op", 180)
+    header = {"v": gift.get("v", "5.5.2"), "fr": gift.get("fr", 60), "ip": ip, "op": op,
+              "w": w, "h": h, "ddd": 0, "assets": gift.get("assets", []) + pattern.assets_for(colors)}
+
+    tmp = out_path + ".part"
+    with open(tmp, "w", encoding="utf-8") as out:
+        out.write(_dump(header)[:-1] + ',"layers":[')
+        # Объединим слои (pattern должен идти первым); запятая — только между непустыми частями
+        sep = ""
+        text = pattern.layers_text(colors)
+        if text:
+            out.write(text)
+            sep = ","
+        for layer in gift["layers"]:
+            out.write(sep)
+            out.write(_dump(_shift_ind(layer, pattern.max_ind)))
+            sep = ","
+        if backdrop and colors and colors.get("center_color"):
+            out.write(sep)
+            out.write(_dump(backdrop_layer(colors, w, h, ip, op, pattern.max_ind + len(gift["layers"]) + 1)))
+        out.write("]}")
+    os.replace(tmp, out_path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="pattern + gift → combined Lottie")
+    ap.add_argument("slugs", nargs="*")
+    ap.add_argument("--pattern", default="pattern.json")
+    ap.add_argument("--all", action="store_true", help="все {slug}.json из ANIMATIONS_DIR")
+    ap.add_argument("--recolor", action="store_true")
+    ap.add_argument("--backdrop", action="store_true")
+    args = ap.parse_args()
+
+    if not args.slugs and not args.all:
+        # одиночный режим, как раньше
+        combine(PatternCache(args.pattern), "gift.json", "combined.json")
+        print("✅ Файл combined.json создан")
+        return
+
+    colors = {}
+    if args.recolor or args.backdrop:
+        with open(os.path.join(ANIMATIONS_DIR, "colors.json"), "r", encoding="utf-8") as f:
+            colors = json.load(f)
+
+    # служебные json'ы ANIMATIONS_DIR (bundle.index.json — индекс asset_bundle.py) — не подарки
+    skip = {"colors.json", "manifest.json", "bundle.index.json", os.path.basename(args.pattern)}
+    slugs = args.slugs or sorted(
+        n[:-len(".json")] for n in os.listdir(ANIMATIONS_DIR) if n.endswith(".json") and n not in skip
+    )
+    os.makedirs(COMBINED_DIR, exist_ok=True)
+    pattern = PatternCache(args.pattern, recolor=args.recolor)
+
+    started, done = time.monotonic(), 0
+    for slug in slugs:
+        try:
+            combine(pattern, os.path.join(ANIMATIONS_DIR, f"{slug}.json"),
+                    os.path.join(COMBINED_DIR, f"{slug}.json"), colors.get(slug), args.backdrop)
+            done += 1
+        except Exception as e:
+            print(f"❌ {slug}: {e}")
+    print(f"✅ Собрано {done}/{len(slugs)} за {time.monotonic() - started:.1f}s → {COMBINED_DIR}")
+
+
+if __name__ == "__main__":
+    main()
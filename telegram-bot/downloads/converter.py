@@ -1,14 +1,13 @@
-import json
-from lottie.parsers.tgs import parse_tgs
+import os
+import sys
 
-# Конвертируем gift.tgs → gift.json
-animation = parse_tgs("gift.tgs")
-with open("gift.json", "w", encoding="utf-8") as out:
-    json.dump(animation.to_dict(), out, ensure_ascii=False, indent=2)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lottie_assets import convert_tgs
 
-# Конвертируем pattern.tgs → pattern.json
-animation = parse_tgs("pattern.tgs")
-with open("pattern.json", "w", encoding="utf-8") as out:
-    json.dump(animation.to_dict(), out, ensure_ascii=False, indent=2)
+# Конвертируем gift.tgs → gift.json и pattern.tgs → pattern.json
+# (.tgs распаковывается напрямую, без python-lottie; оптимизатор и формат — см. lottie_assets.py)
+for name in ("gift", "pattern"):
+    stats = convert_tgs(f"{name}.tgs", f"{name}.json")
+    print(f"{name}.json: {stats['bytes_before']} → {stats['bytes_after']} байт")
 
 print("✅ Конвертация завершена!")
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+from PIL import Image, ImageChops
+from lottie.objects import Animation
+from lottie.exporters.cairo import export_png
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lottie_assets import read_tgs, optimize_lottie, LAYER_REQUIRED_FIELDS
+
+# Проверка оптимизатора: рендерим одни и те же кадры из исходного и оптимизированного Lottie
+# и сравниваем попиксельно. Запуск: python optimize_check.py gift.tgs [precision] [кадров]
+# Расхождение > 2/255 на канал считаем видимым.
+# Animation.load дозаполняет умолчания python-lottie, поэтому рендер не видит полей, без которых
+# ломается lottie-web (например sr у precomp) — их проверяем отдельно по сырому dict.
+
+
+def _all_layers(data):
+    yield from data.get("layers", [])
+    for asset in data.get("assets", []):
+        yield from asset.get("layers", [])
+
+
+def missing_layer_fields(before, after):
+    """
+    [(слой, поле)] — обязательные для lottie-web поля, которые были в исходнике и пропали,
+    и непарные sk/sa в ks (при sk lottie-web читает sa без умолчания).
+    """
+    missing = []
+    for lb, la in zip(_all_layers(before), _all_layers(after)):
+        name = lb.get("nm") or lb.get("ind")
+        for k in LAYER_REQUIRED_FIELDS:
+            if k in lb and k not in la:
+                missing.append((name, k))
+        ks = la.get("ks") or {}
+        if ("sk" in ks) != ("sa" in ks):
+            missing.append((name, "sa" if "sk" in ks else "sk"))
+    return missing
+
+
+src = sys.argv[1] if len(sys.argv) > 1 else "gift.tgs"
+precision = sys.argv[2] if len(sys.argv) > 2 else None
+samples = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+original = read_tgs(src) if src.endswith(".tgs") else json.load(open(src, encoding="utf-8"))
+optimized, stats = optimize_lottie(original, precision)
+print(f"{src}: {stats['bytes_before']} → {stats['bytes_after']} байт "
+      f"(-{100 - 100 * stats['bytes_after'] / stats['bytes_before']:.1f}%), "
+      f"ключей выкинуто: {stats['keyframes_dropped']}, повторов шейпов: {stats['dup_shape_bytes']} байт")
+
+missing = missing_layer_fields(original, optimized)
+for layer, field in missing:
+    print(f"❌ слой {layer}: пропало поле {field}")
+
+a, b = Animation.load(original), Animation.load(optimized)
+worst = 0
+for i in range(samples):
+    frame = a.in_point + (a.out_point - a.in_point) * i // samples
+    export_png(a, "_check_a.png", frame)
+    export_png(b, "_check_b.png", frame)
+    diff = ImageChops.difference(Image.open("_check_a.png").convert("RGBA"), Image.open("_check_b.png").convert("RGBA"))
+    peak = max(hi for _, hi in diff.getextrema())
+    worst = max(worst, peak)
+    print(f"  кадр {frame}: макс. разница {peak}/255")
+os.remove("_check_a.png")
+os.remove("_check_b.png")
+
+if missing:
+    print(f"❌ Структура сломана для lottie-web: пропало полей {len(missing)}")
+print("✅ Визуально без изменений" if worst <= 2 else f"❌ Видимая разница: {worst}/255")
@@ -0,0 +1,244 @@
+import os
+import gzip
+import json
+import shutil
+
+# Общие хелперы для Lottie-ассетов фронтенда (case_updategifts.py, downloads/*.py).
+# По умолчанию JSON пишется минифицированным и рядом кладутся предсжатые .json.gz / .json.br,
+# чтобы статика отдавалась с Content-Encoding без сжатия на лету.
+#   LOTTIE_OUTPUT=pretty      — старый формат (indent=2), удобно для ручного разбора
+#   LOTTIE_PRECOMPRESS=gz,br  — какие сжатые копии класть рядом (пусто — ни одной)
+#   TGS_AS_GZIP=1             — .json.gz = байты .tgs как есть (.tgs — это уже gzip Lottie),
+#                               без перекодирования; отдавать как application/json + gzip.
+#                               Оптимизатор при этом не применяется: иначе .json/.json.br были бы
+#                               оптимизированными, а .json.gz — исходным, и анимация зависела бы
+#                               от Accept-Encoding клиента
+
+LOTTIE_OUTPUT = os.getenv("LOTTIE_OUTPUT", "compact")
+LOTTIE_PRECOMPRESS = [e.strip() for e in os.getenv("LOTTIE_PRECOMPRESS", "gz,br").split(",") if e.strip()]
+TGS_AS_GZIP = os.getenv("TGS_AS_GZIP", "0") == "1"
+
+try:
+    import brotli  # опционально: pip install Brotli
+except ImportError:
+    brotli = None
+
+
+# ── TGS → Lottie без объектной модели lottie ───────────────────
+# .tgs — это просто gzip(Lottie JSON): распаковываем потоком и json.load'им сразу в dict,
+# без parse_tgs(...).to_dict() (тот строит полный граф объектов python-lottie только ради
+# обратной сериализации). python-lottie остаётся нужен лишь для рендера PNG.
+
+_REQUIRED_TOP = ("fr", "ip", "op", "w", "h", "layers")
+
+
+def read_tgs(tgs_path):
+    """Распаковывает .tgs, проверяет, что внутри Lottie, и нормализует верхний уровень. Возвращает dict."""
+    with gzip.open(tgs_path, "rb") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{tgs_path}: не Lottie (верхний уровень — {type(data).__name__})")
+    missing = [k for k in _REQUIRED_TOP if k not in data]
+    if missing:
+        raise ValueError(f"{tgs_path}: не Lottie, нет полей {', '.join(missing)}")
+    if not isinstance(data["layers"], list) or data["op"] <= data["ip"]:
+        raise ValueError(f"{tgs_path}: битый Lottie (layers/ip/op)")
+    # то, что to_dict() python-lottie всегда выставлял и на что рассчитывают плееры
+    data.setdefault("v", "5.5.2")
+    data.setdefault("ddd", 0)
+    data.setdefault("assets", [])
+    return data
+
+
+def convert_tgs(tgs_path, json_path):
+    """
+    .tgs → оптимизированный Lottie JSON (+ сжатые копии). Возвращает stats оптимизатора.
+    При TGS_AS_GZIP оптимизатор выключен, чтобы все варианты несли одно и то же содержимое.
+    """
+    data, stats = optimize_lottie(read_tgs(tgs_path), precision="" if TGS_AS_GZIP else None)
+    write_lottie(data, json_path, tgs_path=tgs_path)
+    return stats
+
+
+def json_variants():
+    """Расширения, которые получает один Lottie: json + доступные сжатые копии."""
+    exts = ["json"]
+    if "gz" in LOTTIE_PRECOMPRESS or TGS_AS_GZIP:
+        exts.append("json.gz")
+    if "br" in LOTTIE_PRECOMPRESS and brotli is not None:
+        exts.append("json.br")
+    return exts
+
+
+def dump_lottie(data) -> bytes:
+    if LOTTIE_OUTPUT == "pretty":
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _write_atomic(path, raw: bytes):
+    tmp = path + ".part"
+    with open(tmp, "wb") as out:
+        out.write(raw)
+    os.replace(tmp, path)
+
+
+def write_lottie(data, json_path, tgs_path=None):
+    """
+    Пишет Lottie в json_path и сжатые копии рядом (json_path + ".gz" / ".br").
+    Если TGS_AS_GZIP и передан tgs_path — .gz копируется из .tgs байт в байт.
+    Возвращает {ext: размер в байтах} для всего записанного.
+    """
+    raw = dump_lottie(data)
+    _write_atomic(json_path, raw)
+    sizes = {"json": len(raw)}
+
+    if TGS_AS_GZIP and tgs_path:
+        publish_tgs_gzip(tgs_path, json_path + ".gz")
+        sizes["json.gz"] = os.path.getsize(json_path + ".gz")
+    elif "gz" in LOTTIE_PRECOMPRESS:
+        # mtime=0 — одинаковый вход даёт одинаковые байты (стабильный sha256 в манифесте)
+        packed = gzip.compress(raw, compresslevel=9, mtime=0)
+        _write_atomic(json_path + ".gz", packed)
+        sizes["json.gz"] = len(packed)
+
+    if "br" in LOTTIE_PRECOMPRESS and brotli is not None:
+        packed = brotli.compress(raw, quality=11)
+        _write_atomic(json_path + ".br", packed)
+        sizes["json.br"] = len(packed)
+
+    return sizes
+
+
+def publish_tgs_gzip(tgs_path, gz_path):
+    """.tgs уже gzip-сжатый Lottie — публикуем как есть, без распаковки и повторного сжатия."""
+    tmp = gz_path + ".part"
+    shutil.copyfile(tgs_path, tmp)
+    os.replace(tmp, gz_path)
+
+
+# ── Оптимизатор Lottie ──────────────────────────────────────────
+# Проход по dict из parse_tgs(...).to_dict() перед записью:
+#   • квантование float до LOTTIE_PRECISION знаков (3 — меньше 1/255 для цветов 0..1, < 0.001px для координат);
+#   • анимированное свойство с одинаковыми значениями во всех ключах → статическое {"a":0,"k":...};
+#     средний из трёх одинаковых подряд ключей выкидывается;
+#   • поля со значениями по умолчанию (hd:false, bm:0, ao:0, h:0 у ключей, нулевые sk+sa парой, mn/ix для выражений).
+#     Выкидываем только то, что lottie-web сам трактует как значение по умолчанию (проверяет на
+#     истинность/равенство). sr не трогаем: lottie-web считает кадр precomp'а как num / data.sr без
+#     умолчания, и без sr precomp получает NaN. python-lottie при загрузке дозаполняет умолчания,
+#     поэтому рендер через него такую поломку не покажет — см. структурную проверку в optimize_check.py.
+# Одинаковые группы шейпов в разных слоях только считаются (stats["dup_shape_bytes"]): в Lottie
+# ссылка на общий контент есть лишь через precomp, а precomp-слой обрезается по w×h композиции —
+# это не lossless. Такие повторы и так почти бесплатны в .json.gz/.json.br.
+# LOTTIE_PRECISION= (пусто) — выключить оптимизатор.
+
+LOTTIE_PRECISION = os.getenv("LOTTIE_PRECISION", "3")
+
+_LAYER_DEFAULTS = {"ddd": 0, "ao": 0, "bm": 0, "hasMask": False}
+LAYER_REQUIRED_FIELDS = ("ty", "ind", "ip", "op", "st", "sr", "ks", "refId", "w", "h")  # обязательны для lottie-web
+_ANY_DEFAULTS = {"hd": False, "bm": 0}
+_EXPRESSION_ONLY = ("mn", "ix")  # нужны только выражениям, а в TGS выражений нет
+
+
+def _quantize(o, p):
+    if isinstance(o, float):
+        v = round(o, p)
+        return int(v) if v == int(v) else v
+    if isinstance(o, list):
+        return [_quantize(v, p) for v in o]
+    if isinstance(o, dict):
+        return {k: _quantize(v, p) for k, v in o.items()}
+    return o
+
+
+def _no_tangents(kf):
+    return not any(any(kf.get(t) or []) for t in ("to", "ti"))
+
+
+def _prune_keyframes(prop):
+    """prop — {"a":1,"k":[keyframes]}; меняет на месте, возвращает число выброшенных ключей."""
+    kfs = prop["k"]
+    valued = [kf for kf in kfs if "s" in kf]
+    if not valued or not all(_no_tangents(kf) for kf in kfs):
+        return 0
+    first = valued[0]["s"]
+    if all(kf["s"] == first and kf.get("e", first) == first for kf in valued):
+        prop["a"] = 0
+        prop["k"] = first[0] if isinstance(first, list) and len(first) == 1 else first
+        return len(kfs)
+    kept = [kfs[0]]
+    for i in range(1, len(kfs) - 1):
+        prev, cur, nxt = kept[-1], kfs[i], kfs[i + 1]
+        if "s" in prev and "s" in cur and "s" in nxt and prev["s"] == cur["s"] == nxt["s"] \
+                and "e" not in prev and "e" not in cur:
+            continue
+        kept.append(cur)
+    kept.append(kfs[-1])
+    dropped = len(kfs) - len(kept)
+    prop["k"] = kept
+    return dropped
+
+
+def _prune(o, stats, in_layers=False):
+    if isinstance(o, list):
+        for v in o:
+            _prune(v, stats, in_layers)
+        return
+    if not isinstance(o, dict):
+        return
+    if o.get("a") == 1 and isinstance(o.get("k"), list) and o["k"] and isinstance(o["k"][0], dict):
+        stats["keyframes_dropped"] += _prune_keyframes(o)
+    if "t" in o and "s" in o:  # ключевой кадр ("h" у композиции — это высота, её не трогаем)
+        if o.get("h") == 1:
+            o.pop("i", None)  # у hold-ключа кривая сглаживания не используется
+            o.pop("o", None)
+        elif o.get("h") == 0:
+            del o["h"]
+    for k, default in _ANY_DEFAULTS.items():
+        if k in o and o[k] == default and type(o[k]) is type(default):
+            del o[k]
+    for k in _EXPRESSION_ONLY:
+        o.pop(k, None)
+    if in_layers:
+        for k, default in _LAYER_DEFAULTS.items():
+            if k in o and o[k] == default and type(o[k]) is type(default):
+                del o[k]
+    ks = o.get("ks")
+    # sk/sa — только парой: lottie-web при ненулевом sk читает sa без умолчания
+    if isinstance(ks, dict) and all(ks.get(k, {"a": 0, "k": 0}) == {"a": 0, "k": 0} for k in ("sk", "sa")):
+        ks.pop("sk", None)
+        ks.pop("sa", None)
+    for k, v in o.items():
+        _prune(v, stats, in_layers=(k == "layers"))
+
+
+def _dup_shape_bytes(data):
+    seen, dup = set(), 0
+    layers = list(data.get("layers", []))
+    for asset in data.get("assets", []):
+        layers.extend(asset.get("layers", []))
+    for layer in layers:
+        for shape in layer.get("shapes", []):
+            raw = json.dumps(shape, sort_keys=True, separators=(",", ":"))
+            if raw in seen:
+                dup += len(raw)
+            seen.add(raw)
+    return dup
+
+
+def optimize_lottie(data, precision=None):
+    """
+    Возвращает (оптимизированный dict, stats) — stats: bytes_before/bytes_after в компактном JSON,
+    keyframes_dropped, dup_shape_bytes. Вход не меняется.
+    """
+    precision = LOTTIE_PRECISION if precision is None else precision
+    before = len(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    stats = {"bytes_before": before, "keyframes_dropped": 0}
+    if precision in ("", None):
+        out = data
+    else:
+        out = _quantize(data, int(precision))
+        _prune(out, stats)
+    stats["bytes_after"] = len(json.dumps(out, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    stats["dup_shape_bytes"] = _dup_shape_bytes(out)
+    return out, stats
@@ -1,8 +1,13 @@
 import os
 import sys
+import time
+import json
+import socket
 import asyncio
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from pyrogram import Client
+from pyrogram.errors import FloodWait, RPCError
 from supabase import create_client, Client as SupabaseClient
 
 sys.stdout.flush()
@@ -17,8 +22,9 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase: SupabaseClient = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Telegram client
-app = Client(session_name, api_id, api_hash)
+# Telegram clients: пул аккаунтов (сессии через запятую; доступны account, OGstorage_account,
+# updategifts_v3, storagescan_v2). По умолчанию — один "account", как раньше.
+GIFT_SESSIONS = [x.strip() for x in os.getenv("GIFT_SESSIONS", session_name).split(",") if x.strip()]
 
 # спец-подарки отправляем через send_gift
 SPECIAL_SEND_SLUGS = {"rocket", "diamond", "bear", "heart"}
@@ -29,79 +35,539 @@ SPECIAL_GIFT_IDS = {
     "heart":   5170145012310081615,
 }
 
+# параллельная отправка: не больше GIFT_CONCURRENCY запросов к Telegram одновременно на аккаунт,
+# подарки одному получателю уходят строго по очереди
+GIFT_CONCURRENCY = int(os.getenv("GIFT_CONCURRENCY", "4"))
+POLL_INTERVAL_SEC = 60
+
+# ошибки, после которых повтор бессмысленен: переводим запись в отдельный статус,
+# чтобы не пытаться отправить её каждый цикл (вернуть в pending можно вручную)
+PERMANENT_ERRORS = {
+    "PEER_ID_INVALID": "peer_invalid",              # пользователь не писал в ЛС
+    "STARGIFT_USAGE_LIMITED": "usage_limited",      # подарок распродан / лимит
+}
+
+# ── Аренда (lease) записей pending_rewards ──────────────────────
+# Несколько отправителей делят один бэклог. Каждый атомарно забирает пачку:
+#   pending ──claim──▶ claimed (lease_owner, lease_until) ──▶ sending ──▶ send / peer_invalid / usage_limited
+# Все переходы — условные UPDATE (WHERE status = ... AND lease_owner = ...), как в claimReward.js:
+# если запись уже забрал другой воркер, UPDATE просто ничего не вернёт.
+#  • claimed с истёкшей арендой — Telegram ещё не вызывался, запись безопасно забирает любой воркер;
+#  • sending с истёкшей арендой — воркер упал между вызовом Telegram и записью статуса; такую запись
+#    НЕ переотправляем, а переводим в unconfirmed для ручной проверки (никогда не шлём дважды);
+#  • ответ Telegram с ошибкой (RPCError) — подарок точно не ушёл, возвращаем запись в pending.
+# Нужны колонки: alter table pending_rewards add column lease_owner text, add column lease_until timestamptz;
+WORKER_ID = os.getenv("GIFT_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SEC = int(os.getenv("GIFT_LEASE_SEC", "300"))
+CLAIM_BATCH = int(os.getenv("GIFT_CLAIM_BATCH", "50"))
+
+
+def _now_iso():
+    return datetime.utcnow().isoformat()
+
+
+def claim_batch():
+    now = _now_iso()
+    lease = {
+        "status": "claimed",
+        "lease_owner": WORKER_ID,
+        "lease_until": (datetime.utcnow() + timedelta(seconds=LEASE_SEC)).isoformat(),
+    }
+
+    # упавшие посреди отправки — на ручную проверку
+    stuck = supabase.table("pending_rewards").update({"status": "unconfirmed"}) \
+        .eq("status", "sending").lt("lease_until", now).execute()
+    for row in stuck.data or []:
+        print(f"⚠ id={row.get('id')} завис в sending (воркер {row.get('lease_owner')}) → unconfirmed", flush=True)
+
+    # сначала просроченные claimed (их уже кто-то забирал, они старше), потом свежие pending
+    expired = supabase.table("pending_rewards").select("id") \
+        .eq("status", "claimed").lt("lease_until", now) \
+        .order("id").limit(CLAIM_BATCH).execute().data or []
+    claimed = []
+    if expired:
+        claimed += supabase.table("pending_rewards").update(lease) \
+            .in_("id", [r["id"] for r in expired]) \
+            .eq("status", "claimed").lt("lease_until", now) \
+            .execute().data or []
+
+    left = CLAIM_BATCH - len(claimed)
+    if left > 0:
+        fresh = supabase.table("pending_rewards").select("id") \
+            .eq("status", "pending") \
+            .order("id").limit(left).execute().data or []
+        if fresh:
+            claimed += supabase.table("pending_rewards").update(lease) \
+                .in_("id", [r["id"] for r in fresh]) \
+                .eq("status", "pending") \
+                .execute().data or []
+
+    return sorted(claimed, key=lambda r: r["id"])
+
+
+def _transition(rec_id, from_status, to_status, extra=None):
+    # условный переход только для своей аренды; повтор того же перехода безвреден
+    data = {"status": to_status}
+    if to_status in ("pending", "send") or to_status in PERMANENT_ERRORS.values():
+        data.update({"lease_owner": None, "lease_until": None})
+    elif to_status in ("claimed", "sending"):
+        # каждый шаг под арендой продлевает её: отсчёт LEASE_SEC идёт от начала этого шага
+        data["lease_until"] = (datetime.utcnow() + timedelta(seconds=LEASE_SEC)).isoformat()
+    data.update(extra or {})
+    res = supabase.table("pending_rewards").update(data) \
+        .eq("id", rec_id).eq("status", from_status).eq("lease_owner", WORKER_ID) \
+        .execute()
+    return bool(res.data)
+
+
+def _classify_error(e):
+    text = str(e)
+    for code, status in PERMANENT_ERRORS.items():
+        if code in text:
+            return code, status
+    return None, None
+
+
+# ── Пул аккаунтов ───────────────────────────────────────────────
+# transfer_gift может сделать только владелец подарка → маршрутизируем по колонке owner_session
+# награды (имя сессии-владельца), а без неё — по инвентарю (msg_id сохранённых подарков каждого
+# аккаунта). msg_id — счётчик внутри аккаунта, у двух аккаунтов может оказаться один и тот же id
+# у разных NFT: такую награду не отправляем (вернётся в pending), чтобы не отдать чужой подарок.
+# Инвентарь перечитывается только при промахе и не чаще INVENTORY_REFRESH_SEC — полный обход
+# get_chat_gifts всех аккаунтов сам по себе провоцирует FloodWait.
+# send_gift покупает подарок за звёзды → отдаём аккаунту с наибольшим балансом, который сейчас
+# не во FloodWait. FloodWait у каждого аккаунта свой.
+#   alter table pending_rewards add column owner_session text;  -- опционально
+INVENTORY_REFRESH_SEC = int(os.getenv("GIFT_INVENTORY_REFRESH_SEC", "60"))
+_accounts = []                        # [{"name", "client", "sem", "flood_until", "stars", "owned"}]
+_inventory = {"refreshed_at": 0.0}
+
+
+async def _refresh_account(acc):
+    owned = set()
+    async for g in acc["client"].get_chat_gifts("me"):
+        gid = getattr(g, "message_id", None) or getattr(g, "owned_gift_id", None)
+        if gid is not None:
+            owned.add(str(gid))
+    acc["owned"] = owned
+    try:
+        acc["stars"] = await acc["client"].get_stars_balance()
+    except Exception as e:
+        print(f"⚠ [{acc['name']}] не удалось получить баланс звёзд: {e}", flush=True)
+
+
+async def refresh_inventory(force=False):
+    if not force and time.monotonic() - _inventory["refreshed_at"] < INVENTORY_REFRESH_SEC:
+        return
+    _inventory["refreshed_at"] = time.monotonic()
+    for acc in _accounts:
+        try:
+            await _refresh_account(acc)
+        except FloodWait as e:
+            acc["flood_until"] = max(acc["flood_until"], time.monotonic() + e.value)
+        except Exception as e:
+            print(f"⚠ [{acc['name']}] не удалось обновить инвентарь: {e}", flush=True)
+    print("🗂 Аккаунты: " + ", ".join(
+        f"{a['name']}(подарков={len(a['owned'])}, звёзд={a['stars']})" for a in _accounts
+    ), flush=True)
+
+
+async def start_pool():
+    for name in GIFT_SESSIONS:
+        client = Client(name, api_id, api_hash)
+        await client.start()
+        _accounts.append({
+            "name": name,
+            "client": client,
+            "sem": asyncio.Semaphore(GIFT_CONCURRENCY),
+            "flood_until": 0.0,
+            "stars": None,
+            "owned": set(),
+        })
+        print(f"📤 [{name}] клиент запущен", flush=True)
+    await refresh_inventory(force=True)
+
+
+def _owners_of(msg_id):
+    return [acc for acc in _accounts if str(msg_id) in acc["owned"]]
+
+
+async def _wait_flood(acc):
+    pause = acc["flood_until"] - time.monotonic()
+    if pause > 0:
+        await asyncio.sleep(pause)
+    return acc
+
+
+async def _pick_account(special, msg_id, owner_session=None):
+    """
+    Выбирает аккаунт под награду и ждёт, пока у него кончится FloodWait.
+    Для transfer_gift — владелец: по owner_session, иначе единственный аккаунт с этим msg_id
+    в инвентаре (с одним аккаунтом в пуле — он, как было до пула). Если владелец неизвестен
+    или неоднозначен — None. Для send_gift — свободный аккаунт с наибольшим балансом звёзд.
+    """
+    if not special:
+        if owner_session:
+            owner = next((a for a in _accounts if a["name"] == owner_session), None)
+            if owner is None:
+                print(f"⚠ Сессия-владелец {owner_session} не в пуле (GIFT_SESSIONS)", flush=True)
+                return None
+            return await _wait_flood(owner)
+        owners = _owners_of(msg_id)
+        if len(owners) != 1:
+            await refresh_inventory()  # инвентарь мог устареть: новый подарок или уже отданный
+            owners = _owners_of(msg_id)
+        if len(owners) > 1:
+            print(f"⚠ msg_id={msg_id} есть у нескольких аккаунтов "
+                  f"({', '.join(a['name'] for a in owners)}) — нужен owner_session", flush=True)
+            return None
+        if not owners:
+            if len(_accounts) > 1:
+                print(f"⚠ msg_id={msg_id} не найден ни в одном инвентаре", flush=True)
+                return None
+            owners = _accounts
+        return await _wait_flood(owners[0])
+
+    while True:
+        now = time.monotonic()
+        free = [a for a in _accounts if a["flood_until"] <= now]
+        if free:
+            # без звёзд Telegram сам вернёт ошибку — но сначала пробуем тех, у кого баланс есть
+            return max(free, key=lambda a: a["stars"] or 0)
+        # все во FloodWait — ждём ближайшего освобождения
+        await asyncio.sleep(min(a["flood_until"] for a in _accounts) - now)
+
+
+async def _call_with_flood(acc, special, rec_id, method, **kwargs):
+    """
+    Переводит запись claimed → sending и вызывает Telegram. FloodWait значит, что вызов не выполнен:
+    запись возвращается в claimed (со свежей арендой) на время ожидания, и в sending — только прямо
+    перед следующей попыткой. transfer_gift ждёт владельца, send_gift переезжает на другой свободный аккаунт.
+    Возвращает (acc, результат) или (None, None), если аренду перехватили.
+    """
+    while True:
+        async with acc["sem"]:
+            if not await asyncio.to_thread(_transition, rec_id, "claimed", "sending"):
+                return None, None
+            try:
+                return acc, await getattr(acc["client"], method)(**kwargs)
+            except FloodWait as e:
+                acc["flood_until"] = max(acc["flood_until"], time.monotonic() + e.value)
+                print(f"⏳ [{acc['name']}] FloodWait {e.value}s", flush=True)
+        await asyncio.to_thread(_transition, rec_id, "sending", "claimed")
+        # transfer_gift может сделать только этот же аккаунт — ждём его; send_gift ищет свободный
+        acc = await _pick_account(True, None) if special else await _wait_flood(acc)
+
+
+async def deliver(item):
+    """
+    Отправляет одну арендованную награду. Возвращает итоговый статус: "send", статус постоянной
+    ошибки, "unconfirmed" или None (вернули в pending / аренду перехватили — попробуем позже).
+    """
+    rec_id  = item.get("id")
+    msg_id  = item.get("msg_id")
+    chat_id = item.get("telegram_id")
+    username = item.get("username")  # может быть None
+    nft_name = (item.get("nft_name") or "").strip().lower()
+    gift_id_from_row = item.get("nft_number")  # может быть неточным из-за JS
+
+    special = nft_name in SPECIAL_SEND_SLUGS
+    resolved_id = SPECIAL_GIFT_IDS.get(nft_name) if special else None
+    if special and not resolved_id:
+        print(f"⚠ gift_id не найден для {nft_name}, пропуск id={rec_id}", flush=True)
+        await asyncio.to_thread(_transition, rec_id, "claimed", "pending")
+        return None
+
+    # выбираем аккаунт (и пережидаем его FloodWait, пока запись ещё claimed); намерение отправить
+    # фиксируется переходом в sending внутри _call_with_flood — если аренду перехватили, запись не трогаем
+    acc = await _pick_account(special, msg_id, item.get("owner_session"))
+    if acc is None:
+        await asyncio.to_thread(_transition, rec_id, "claimed", "pending")
+        return None
+
+    try:
+        # если это спец-подарок из магазина — используем send_gift с фиксированным gift_id
+        if special:
+            # chat_id может быть int, либо username-строка
+            target = chat_id if chat_id is not None else (username or "").lstrip("@")
+            print(f"➡️ [{acc['name']}] send_gift: {nft_name} -> gift_id={resolved_id}, target={target}", flush=True)
+            acc, _ = await _call_with_flood(acc, True, rec_id, "send_gift", chat_id=target, gift_id=int(resolved_id))
+        else:
+            # иначе — старая логика: передаём уже купленный подарок по msg_id
+            print(f"➡️ [{acc['name']}] transfer_gift: msg_id={msg_id}, chat_id={chat_id}", flush=True)
+            acc, _ = await _call_with_flood(acc, False, rec_id, "transfer_gift", owned_gift_id=str(msg_id), new_owner_chat_id=chat_id)
+            if acc is not None:
+                acc["owned"].discard(str(msg_id))
+
+    except RPCError as e:
+        # Telegram ответил ошибкой — подарок не ушёл
+        code, status = _classify_error(e)
+        if code == "PEER_ID_INVALID":
+            print(f"⚠ Пользователь {chat_id or username} не писал в ЛС. Подарок не отправлен.", flush=True)
+        elif code == "STARGIFT_USAGE_LIMITED":
+            print(f"⚠ Gift {gift_id_from_row} недоступен (лимит/распродан).", flush=True)
+        else:
+            print(f"❌ Ошибка при отправке ({nft_name}): {e}", flush=True)
+            status = "pending"
+        try:
+            await asyncio.to_thread(_transition, rec_id, "sending", status)
+        except Exception as db_err:
+            print(f"⚠ Не удалось перевести id={rec_id} в {status}: {db_err}", flush=True)
+        return status if status != "pending" else None
+
+    except Exception as e:
+        # сеть/таймаут: неизвестно, ушёл ли подарок — не рискуем повторной отправкой
+        print(f"❌ Ошибка при отправке ({nft_name}), результат неизвестен: {e}", flush=True)
+        try:
+            await asyncio.to_thread(_transition, rec_id, "sending", "unconfirmed")
+        except Exception as db_err:
+            print(f"⚠ Не удалось перевести id={rec_id} в unconfirmed: {db_err}", flush=True)
+        return "unconfirmed"
+
+    if acc is None:
+        print(f"⏭️ id={rec_id}: аренда потеряна, пропуск", flush=True)
+        return None
+
+    # подарок ушёл — статус запишем пачкой (до записи запись остаётся в sending под нашей арендой,
+    # так что даже при падении повторной отправки не будет)
+    if special:
+        print("✅ Отправлено через send_gift", flush=True)
+    else:
+        print(f"✅ Подарок {msg_id} отправлен пользователю {chat_id}", flush=True)
+    _buffer_delivered(rec_id, None if special else msg_id)
+    return "send"
+
+
+# ── Пакетная запись доставленных ────────────────────────────────
+# Вместо двух UPDATE на каждый подарок копим id и msg_id и сбрасываем двумя UPDATE ... IN (...):
+# в конце пачки, при переполнении буфера или раз в DELIVERED_FLUSH_SEC.
+DELIVERED_FLUSH_SEC = float(os.getenv("GIFT_DELIVERED_FLUSH_SEC", "2"))
+DELIVERED_BATCH = int(os.getenv("GIFT_DELIVERED_BATCH", "100"))
+_delivered = {"ids": [], "msg_ids": []}
+
+
+def _buffer_delivered(rec_id, msg_id):
+    _delivered["ids"].append(rec_id)
+    if msg_id is not None:
+        _delivered["msg_ids"].append(msg_id)
+
+
+def _write_delivered(ids, msg_ids):
+    sent_at = _now_iso()
+    for i in range(0, len(ids), DELIVERED_BATCH):
+        supabase.table("pending_rewards").update({
+            "status": "send",
+            "sent_at": sent_at,
+            "lease_owner": None,
+            "lease_until": None,
+        }).in_("id", ids[i:i+DELIVERED_BATCH]) \
+            .eq("status", "sending").eq("lease_owner", WORKER_ID).execute()
+    for i in range(0, len(msg_ids), DELIVERED_BATCH):
+        supabase.table("available_gifts").update({"used": True}) \
+            .in_("msg_id", msg_ids[i:i+DELIVERED_BATCH]).execute()
+
+
+async def flush_delivered():
+    ids, msg_ids = _delivered["ids"], _delivered["msg_ids"]
+    if not ids:
+        return
+    # забираем буфер целиком: новые доставки во время await попадут в свежий
+    _delivered["ids"], _delivered["msg_ids"] = [], []
+    try:
+        await asyncio.to_thread(_write_delivered, ids, msg_ids)
+        print(f"📝 Статусы записаны: {len(ids)} pending_rewards, {len(msg_ids)} available_gifts", flush=True)
+    except Exception as e:
+        # вернём в буфер — попробуем при следующем сбросе; аренда sending защищает от повторной отправки
+        print(f"⚠ Не удалось записать статусы ({len(ids)}): {e}", flush=True)
+        _delivered["ids"][:0] = ids
+        _delivered["msg_ids"][:0] = msg_ids
+
+
+async def _flush_delivered_periodically():
+    while True:
+        await asyncio.sleep(DELIVERED_FLUSH_SEC)
+        if len(_delivered["ids"]):
+            await flush_delivered()
+
+
+async def _deliver_recipient(items, stats):
+    # подарки одному получателю — последовательно, в порядке выборки
+    for item in items:
+        result = await deliver(item)
+        if result == "send":
+            _record_delivery(item)
+        if len(_delivered["ids"]) >= DELIVERED_BATCH:
+            await flush_delivered()
+        stats[result or "retry"] = stats.get(result or "retry", 0) + 1
+
+
+async def dispatch(pending):
+    # группируем по получателю, получателей обрабатываем параллельно
+    by_recipient = {}
+    for item in pending:
+        key = item.get("telegram_id") or (item.get("username") or "").lstrip("@")
+        by_recipient.setdefault(key, []).append(item)
+
+    stats = {}
+    started = time.monotonic()
+    flusher = asyncio.create_task(_flush_delivered_periodically())
+    try:
+        await asyncio.gather(*(_deliver_recipient(items, stats) for items in by_recipient.values()))
+    finally:
+        flusher.cancel()
+        await flush_delivered()
+    elapsed = time.monotonic() - started
+
+    sent = stats.get("send", 0)
+    rate = sent / elapsed if elapsed > 0 else 0.0
+    print(f"📊 Цикл: отправлено {sent}/{len(pending)} за {elapsed:.1f}s ({rate:.2f} подарков/с) | {stats}", flush=True)
+    return stats
+
+
+# ── Пробуждение по событию ──────────────────────────────────────
+# Вместо фиксированного sleep(60) ждём сигнала о новой награде. Источники (GIFT_WAKEUP, через запятую):
+#   realtime — подписка Supabase Realtime на INSERT в pending_rewards (таблица должна быть в
+#              публикации supabase_realtime);
+#   udp      — любой датаграм на 127.0.0.1:GIFT_WAKEUP_PORT (локальная замена для тестов или
+#              пинок из бэкенда после insert; тело может быть {"id": ...}).
+# Поллинг остаётся запасным: после пустого цикла интервал растёт от POLL_MIN_SEC до POLL_INTERVAL_SEC,
+# после непустого — сбрасывается.
+GIFT_WAKEUP = os.getenv("GIFT_WAKEUP", "realtime")
+WAKEUP_PORT = int(os.getenv("GIFT_WAKEUP_PORT", "8765"))
+POLL_MIN_SEC = float(os.getenv("GIFT_POLL_MIN_SEC", "5"))
+
+_wakeup = {"event": None, "sources": []}  # sources — держим ссылки, чтобы подписки жили
+_first_seen = {}                      # id награды → unix-время, когда мы о ней узнали
+_latencies = deque(maxlen=1000)       # время до доставки (сек) по последним наградам
+
+
+def _notify_new_reward(rec_id=None, ts=None):
+    if rec_id is not None:
+        if len(_first_seen) > 5000:
+            # награды, доставленные другими воркерами, сюда не вернутся — чистим старьё
+            cutoff = time.time() - 3600
+            for k in [k for k, v in _first_seen.items() if v < cutoff]:
+                del _first_seen[k]
+        _first_seen.setdefault(rec_id, ts or time.time())
+    if _wakeup["event"]:
+        _wakeup["event"].set()
+
+
+def _parse_commit_ts(v):
+    # ISO-время Supabase → unix; без зоны — это UTC (timestamp without time zone)
+    try:
+        dt = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+        return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+    except Exception:
+        return None
+
+
+async def _start_realtime():
+    from supabase import acreate_client
+
+    client = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+
+    def on_insert(payload):
+        data = payload.get("data", payload) if isinstance(payload, dict) else {}
+        record = data.get("record") or {}
+        _notify_new_reward(record.get("id"), _parse_commit_ts(data.get("commit_timestamp")))
+
+    channel = client.channel("pending_rewards_inserts")
+    channel.on_postgres_changes("INSERT", schema="public", table="pending_rewards", callback=on_insert)
+    await channel.subscribe()
+    print("📡 Подписка Realtime на pending_rewards активна", flush=True)
+    return client
+
+
+class _WakeupProtocol(asyncio.DatagramProtocol):
+    def datagram_received(self, data, addr):
+        try:
+            rec_id = json.loads(data or b"{}").get("id")
+        except Exception:
+            rec_id = None
+        _notify_new_reward(rec_id)
+
+
+async def _start_wakeup_sources():
+    _wakeup["event"] = asyncio.Event()
+    keep = []
+    sources = {x.strip() for x in GIFT_WAKEUP.split(",") if x.strip()}
+    if "realtime" in sources:
+        try:
+            keep.append(await _start_realtime())
+        except Exception as e:
+            print(f"⚠ Realtime недоступен, остаётся поллинг: {e}", flush=True)
+    if "udp" in sources:
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            _WakeupProtocol, local_addr=("127.0.0.1", WAKEUP_PORT)
+        )
+        keep.append(transport)
+        print(f"📡 UDP-пробуждение на 127.0.0.1:{WAKEUP_PORT}", flush=True)
+    return keep
+
+
+async def _sleep_until_wakeup(timeout):
+    event = _wakeup["event"]
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+        print("🔔 Пробуждение: новая награда", flush=True)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+
+def _record_delivery(item):
+    # от created_at награды (claim_batch получает строки целиком): в задержку входит и ожидание аренды;
+    # время пробуждения и момент аренды — только если created_at нет
+    seen = _first_seen.pop(item.get("id"), None)
+    t0 = _parse_commit_ts(item.get("created_at")) if item.get("created_at") else None
+    t0 = t0 or seen or item.get("_claimed_at")
+    if t0:
+        _latencies.append(time.time() - t0)
+
+
+def _latency_report():
+    if not _latencies:
+        return ""
+    xs = sorted(_latencies)
+    pick = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))]
+    return f"время до доставки p50={pick(0.5):.1f}s p90={pick(0.9):.1f}s p99={pick(0.99):.1f}s (n={len(xs)})"
+
+
 async def send_pending_gifts():
-    print("🟢 Скрипт запущен — до await app.start()", flush=True)
-    await app.start()
-    print("📤 После app.start(): клиент запущен", flush=True)
+    print(f"🟢 Скрипт запущен — запускаем аккаунты: {', '.join(GIFT_SESSIONS)}", flush=True)
+    await start_pool()
+
+    _wakeup["sources"] = await _start_wakeup_sources()
+    interval = POLL_MIN_SEC
 
     while True:
         print("🔄 Новый круг проверки pending_rewards...", flush=True)
 
-        # добавили PK id, чтобы обновлять запись надёжно
-        response = supabase.table("pending_rewards") \
-            .select("id, msg_id, telegram_id, username, nft_name, nft_number") \
-            .eq("status", "pending") \
-            .execute()
-        pending = response.data
+        # атомарно арендуем пачку; пока пачки полные — берём следующую сразу
+        try:
+            pending = await asyncio.to_thread(claim_batch)
+        except Exception as e:
+            print(f"❌ Ошибка аренды pending_rewards: {e}", flush=True)
+            pending = []
 
         if not pending:
             print("⛔ Нет подарков для отправки", flush=True)
+            interval = min(interval * 2, POLL_INTERVAL_SEC)  # адаптивный бэкофф запасного поллинга
+        else:
+            print(f"📥 {WORKER_ID}: арендовано {len(pending)}", flush=True)
+            claimed_at = time.time()
+            for item in pending:
+                item["_claimed_at"] = claimed_at
+            await dispatch(pending)
+            interval = POLL_MIN_SEC
+            report = _latency_report()
+            if report:
+                print(f"⏱ {report}", flush=True)
+            if len(pending) >= CLAIM_BATCH:
+                continue
 
-        for item in pending:
-            rec_id  = item.get("id")
-            msg_id  = item.get("msg_id")
-            chat_id = item.get("telegram_id")
-            username = item.get("username")  # может быть None
-            nft_name = (item.get("nft_name") or "").strip().lower()
-            gift_id_from_row = item.get("nft_number")  # может быть неточным из-за JS
-
-            try:
-                # если это спец-подарок из магазина — используем send_gift с фиксированным gift_id
-                if nft_name in SPECIAL_SEND_SLUGS:
-                    resolved_id = SPECIAL_GIFT_IDS.get(nft_name)
-                    if not resolved_id:
-                        print(f"⚠ gift_id не найден для {nft_name}, пропуск id={rec_id}", flush=True)
-                        continue
-
-                    # chat_id может быть int, либо username-строка
-                    target = chat_id if chat_id is not None else (username or "").lstrip("@")
-                    print(f"➡️ send_gift: {nft_name} -> gift_id={resolved_id}, target={target}", flush=True)
-                    await app.send_gift(chat_id=target, gift_id=int(resolved_id))
-
-                    # обновляем ТОЛЬКО текущую запись по PK
-                    supabase.table("pending_rewards").update({
-                        "status": "send",
-                        "sent_at": datetime.utcnow().isoformat()
-                    }).eq("id", rec_id).execute()
-
-                    print("✅ Отправлено через send_gift, статус обновлён", flush=True)
-                    continue
-
-                # иначе — старая логика: передаём уже купленный подарок по msg_id
-                print(f"➡️ transfer_gift: msg_id={msg_id}, chat_id={chat_id}", flush=True)
-                await app.transfer_gift(owned_gift_id=str(msg_id), new_owner_chat_id=chat_id)
-                print(f"✅ Подарок {msg_id} отправлен пользователю {chat_id}", flush=True)
-
-                # обновляем pending_rewards и помечаем available_gifts.used = True
-                supabase.table("pending_rewards").update({
-                    "status": "send",
-                    "sent_at": datetime.utcnow().isoformat()
-                }).eq("id", rec_id).execute()
-
-                supabase.table("available_gifts").update({"used": True}) \
-                    .eq("msg_id", msg_id).execute()
-                print("📝 Статус и used обновлены", flush=True)
-
-            except Exception as e:
-                text = str(e)
-                if "PEER_ID_INVALID" in text:
-                    print(f"⚠ Пользователь {chat_id or username} не писал в ЛС. Подарок не отправлен.", flush=True)
-                elif "STARGIFT_USAGE_LIMITED" in text:
-                    print(f"⚠ Gift {gift_id_from_row} недоступен (лимит/распродан).", flush=True)
-                else:
-                    print(f"❌ Ошибка при отправке ({nft_name}): {e}", flush=True)
-
-        await asyncio.sleep(60)
+        await _sleep_until_wakeup(interval)
 
 if __name__ == "__main__":
     print("🚀 Запуск event loop...", flush=True)
@@ -0,0 +1,85 @@
+import json
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Локальный HTTP-сервер для webhook-режима бота.
+# Telegram POST-ит апдейты на WEBHOOK_PATH, сервер сразу отвечает 200 и кладёт апдейт
+# в пул воркеров (dispatch(update_dict) выполняется уже там). Проверить локально:
+#   curl -X POST localhost:8443/telegram/webhook -d '{"update_id":1,"message":{...}}'
+
+
+REQUEST_TIMEOUT_SEC = 10  # медленное/зависшее соединение не держит поток дольше этого
+
+
+def _make_handler(path, secret, pool, dispatch):
+    class Handler(BaseHTTPRequestHandler):
+        timeout = REQUEST_TIMEOUT_SEC
+
+        def _reply(self, code, body=b"ok"):
+            self.send_response(code)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            # health-check для балансировщика
+            self._reply(200)
+
+        def do_POST(self):
+            if self.path != path:
+                return self._reply(404, b"not found")
+            if secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                return self._reply(403, b"forbidden")
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                update = json.loads(self.rfile.read(length) or b"{}")
+            except Exception:
+                return self._reply(400, b"bad request")
+            try:
+                pool.submit(_safe_dispatch, dispatch, update)
+            except RuntimeError:
+                # пул уже закрывается — пусть Telegram повторит доставку позже
+                return self._reply(503, b"shutting down")
+            self._reply(200)
+
+        def log_message(self, fmt, *args):
+            pass  # без access-лога на каждый апдейт
+
+    return Handler
+
+
+def _safe_dispatch(dispatch, update):
+    try:
+        dispatch(update)
+    except Exception as e:
+        print(f"⚠️ Ошибка обработки апдейта {update.get('update_id')}: {e}")
+
+
+def serve_webhook(dispatch, host="0.0.0.0", port=8443, path="/telegram/webhook", secret=None, workers=8):
+    """
+    Блокирующий запуск webhook-сервера. На SIGINT/SIGTERM перестаёт принимать запросы
+    и дожидается обработки уже принятых апдейтов.
+    """
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="update")
+    # соединения обслуживаются каждое в своём потоке: одно медленное не блокирует приём апдейтов
+    server = ThreadingHTTPServer((host, port), _make_handler(path, secret, pool, dispatch))
+    server.daemon_threads = True
+
+    def _stop(signum, frame):
+        print("🛑 Остановка webhook-сервера...")
+        # shutdown() ждёт выхода из serve_forever, поэтому зовём из отдельного потока
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    print(f"🌐 Webhook слушает http://{host}:{port}{path} (workers: {workers})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pool.shutdown(wait=True)  # дренируем принятые апдейты
+        print("✅ Webhook-сервер остановлен, очередь апдейтов обработана")